@@ -21,11 +21,20 @@ from traceback import print_exc
 
 from os import path
 from glob import glob
+from time import perf_counter
 from pygount import ProjectSummary, SourceAnalysis
 
 from utils.numbers import Numbers
+from utils.identity import MemberIndex
+from utils.publish import Publisher
+from utils.http import HTTPClient
+from utils.monitor import LoopMonitor
+from utils.metrics import metrics
+from utils.metrics_server import MetricsServer
+from utils.scheduler import Scheduler
+from utils.statistics_history import StatisticsHistory
 from utils.settings import init_settings
-from utils.reddit import initiate_reddit, get_reddit
+from utils.reddit import initiate_reddit, get_reddit, MessageQueue
 from utils.sentry import initiate_sentry, get_sentry
 from utils.classes import NumEmbed, PointsLeaderboard
 
@@ -42,13 +51,40 @@ class TheNumberGod(commands.Bot):
         # Initiate the Reddit instance.
         initiate_reddit(auth_info=self.settings.reddit.auth_info, main_sub_name=self.settings.reddit.subreddit)
         self.reddit = get_reddit()
+        metrics.instrument_reddit(self.reddit)
         self.settings.load_wiki_settings(self.reddit)
 
+        # Start the outbound private message queue.
+        self.message_queue = MessageQueue(self.reddit)
+
         # Load the numbers.
         self.numbers = Numbers(reddit=self.reddit, settings=self.settings)
 
+        # Load the publisher (used to skip and merge writes to Reddit).
+        self.publisher = Publisher()
+
         # Load the points leaderboard.
-        self.points_leaderboard = PointsLeaderboard(self.reddit)
+        self.points_leaderboard = PointsLeaderboard(self.reddit, self.publisher)
+
+        # Load the history of the daily number statistics.
+        self.statistics_history = StatisticsHistory()
+
+        # Load the Discord to Reddit member index.
+        self.member_index = MemberIndex()
+
+        # The shared HTTP client (used for external web services).
+        self.web_client = HTTPClient()
+
+        # The event loop lag monitor (started once the bot is ready).
+        self.loop_monitor = LoopMonitor()
+
+        # The optional metrics and health endpoint.
+        self.metrics_server = MetricsServer(self, self.settings.metrics_port, self.settings.metrics_host) if self.settings.metrics_port else None
+        metrics.register_gauge("tng_queue_depth", lambda: len(self.message_queue), queue="message_queue")
+        metrics.register_gauge("tng_queue_depth", lambda: len(self.publisher.pending), queue="publisher")
+
+        # Load the job scheduler (the modules register their timed jobs on it).
+        self.scheduler = Scheduler()
 
         # Calculate the number of lines of code used.
         self.calculate_loc()
@@ -71,6 +107,14 @@ class TheNumberGod(commands.Bot):
             ),
         )
 
+        # Time the commands and the Discord REST API requests.
+        metrics.instrument_discord(self.http)
+        self.before_invoke(self.command_started)
+        self.after_invoke(self.command_finished)
+
+        # Dispatch an event to the modules whenever a number is assigned.
+        self.numbers.subscribe(self.dispatch_number_change)
+
         # Load the modules.
         for module in [
             module.replace(".py", "")
@@ -100,9 +144,36 @@ class TheNumberGod(commands.Bot):
         for language_summary in project_summary.language_to_language_summary_map.values():
             self.lines_of_code += language_summary.code_count
 
+    def dispatch_number_change(self, username: str, old_number: int, number: int) -> None:
+        """
+        Dispatches a 'number_change' event. This is safe to call from the stream threads.
+        """
+        self.loop.call_soon_threadsafe(self.dispatch, "number_change", username, old_number, number)
+
+    async def command_started(self, ctx) -> None:
+        ctx.started = perf_counter()
+
+    async def command_finished(self, ctx) -> None:
+        # Record how long the command took (and whether it failed).
+        if hasattr(ctx, "started"):
+            metrics.observe("command", ctx.command.qualified_name, perf_counter() - ctx.started, ctx.command_failed)
+
+    async def close(self) -> None:
+        # Close the shared HTTP session (and the metrics server) before closing the bot.
+        await self.web_client.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await super().close()
+
     async def on_ready(self) -> None:
         print("Loaded Discord succesfully.")
 
+        # Start the scheduled jobs and the loop monitor.
+        self.scheduler.start()
+        self.loop_monitor.start()
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+
 
 if __name__ == "__main__":
     # Initiate the bot.
@@ -22,7 +22,8 @@ from threading import Thread
 from asyncio import run_coroutine_threadsafe
 
 from utils.classes import NumEmbed
-from utils.wrappers import stream_wrapper
+from utils.metrics import metrics
+from utils.wrappers import stream_wrapper, paced_stream
 from utils.numbers import is_allowed_number
 
 
@@ -33,8 +34,9 @@ class Assignment(Cog):
         # These are the users who have already been told they're not eligible for a number.
         self.refused_already = []
 
-        # Watches the comments on the assignment thread.
-        self.comments_thread = Thread(target=self.watch_comments)
+        # Watches the comments on the assignment thread (its metrics are kept if the stream restarts).
+        metrics.register_stream("comments")
+        self.comments_thread = Thread(target=self.watch_comments, name="comments-stream")
         self.comments_thread.start()
 
         print("ASSIGNMENT: Watching assignment thread comments.")
@@ -45,7 +47,7 @@ class Assignment(Cog):
         :param username: The username of the user who has just received a number.
         :param number: The number of the user who has just received a number.
         """
-        number_feed_channel = self.bot.get_channel(self.bot.settings.discord.ids["feed_channels"]["number_feed"])
+        number_feed_channel = self.bot.get_channel(self.bot.settings.compiled.feed_channels["number_feed"])
         await number_feed_channel.send(
             "",
             embed=NumEmbed(
@@ -89,8 +91,9 @@ class Assignment(Cog):
         """
         Watches for comments made on the main subreddit. Then assigns numbers to comments in the assignment thread.
         """
-        # Start a comments stream.
-        for comment in self.bot.reddit.main_subreddit.stream.comments(skip_existing=True):
+        # Start a comments stream (which yields None after each poll so that a heartbeat can be recorded).
+        for comment in paced_stream(self.bot.reddit.main_subreddit.stream.comments(skip_existing=True, pause_after=-1), "comments"):
+
             # Check that the comment was made on the assignment thread.
             # If it wasn't then continue on to review the next comment.
             if comment.submission.id != self.bot.settings.reddit.assignment.id:
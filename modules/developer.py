@@ -0,0 +1,220 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from discord import File
+from discord.ext.commands import Cog, command, check
+
+import tracemalloc
+
+from io import BytesIO
+from asyncio import sleep
+from threading import get_ident, enumerate as enumerate_threads
+
+from utils.classes import NumEmbed
+from utils.profiling import sample_threads, format_profile, take_snapshot, format_snapshot_diff
+from utils.checks import is_developer
+from utils.metrics import metrics
+
+
+# The names of the threads (other than the event loop) that are profiled.
+PROFILED_THREADS = ("comments-stream", "submissions-stream", "inbox-stream", "pm-queue")
+
+
+class Developer(Cog):
+    def __init__(self, bot) -> None:
+        self.bot = bot
+
+        # Only one profile can run at a time.
+        self.profiling = False
+
+    @check(is_developer)
+    @command(aliases=["scheduler"])
+    async def jobs(self, ctx) -> None:
+        """
+        (DEVELOPER) View the scheduled jobs and their timings.
+        """
+        fields = {}
+        for job in self.bot.scheduler.jobs.values():
+            fields[job.name] = "\n".join([
+                f"Last Run: {job.last_run:%d/%m %H:%M} UTC" if job.last_run else "Last Run: Never",
+                f"Next Run: {job.next_run:%d/%m %H:%M} UTC" if job.next_run else "Next Run: Pending",
+                f"Runs: {job.runs} ({job.failures} failed)",
+                f"Duration: {job.last_duration:.2f}s (avg {job.average_duration:.2f}s, max {job.max_duration:.2f}s)",
+                *([f"Last Failure: {job.last_failure:%d/%m %H:%M} UTC ({job.last_error})"] if job.last_failure else []),
+            ])
+
+        await ctx.send(
+            "",
+            embed=NumEmbed(
+                title="Scheduled Jobs",
+                fields=fields,
+                user=ctx.author,
+                footer_text="Restricted Cmd",
+            ),
+        )
+
+    @check(is_developer)
+    @command(aliases=["lag", "loopmonitor"])
+    async def looplag(self, ctx) -> None:
+        """
+        (DEVELOPER) View the event loop lag and the most recent calls that blocked it.
+        """
+        monitor = self.bot.loop_monitor
+        fields = {
+            "Current Lag": f"{monitor.current_lag * 1000:.0f}ms",
+            "Average Lag": f"{monitor.average_lag * 1000:.0f}ms",
+            "Max Lag": f"{monitor.max_lag * 1000:.0f}ms",
+            "Threshold": f"{monitor.threshold * 1000:.0f}ms",
+        }
+        for i, stall in enumerate(reversed(list(monitor.stalls)[-5:])):
+            fields[f"Stall #{i + 1} ({stall['time']:%d/%m %H:%M:%S} UTC)"] = f"{stall['duration']:.2f}s at `{stall['call_site']}`"
+
+        description = "The event loop hasn't been blocked past the threshold."
+        if monitor.stalls:
+            description = f"Stack of the latest stall:\n```{monitor.stalls[-1]['stack'][-1500:]}```"
+
+        await ctx.send(
+            "",
+            embed=NumEmbed(
+                title="Event Loop Lag",
+                description=description,
+                fields=fields,
+                user=ctx.author,
+                footer_text="Restricted Cmd",
+            ),
+        )
+
+    @check(is_developer)
+    @command(aliases=["latency", "timings"])
+    async def perf(self, ctx, kind: str = None) -> None:
+        """
+        (DEVELOPER) View the latency percentiles of the commands and upstream calls (reddit, discord and http).
+        """
+        kinds = [kind] if kind else metrics.kinds
+
+        fields = {}
+        for histogram_kind in kinds:
+            # Show the most used names of each kind.
+            histograms = sorted(metrics.by_kind(histogram_kind).items(), key=lambda item: -item[1].count)[:8]
+            if not histograms:
+                continue
+
+            fields[histogram_kind.capitalize()] = "\n".join(
+                f"`{name[:40]}` {histogram.count}x | "
+                f"{histogram.percentile(0.5) * 1000:.0f}/{histogram.percentile(0.95) * 1000:.0f}/{histogram.percentile(0.99) * 1000:.0f}ms"
+                + (f" | {histogram.error_rate:.0%} err" if histogram.errors else "")
+                for name, histogram in histograms
+            )[:1024]
+
+        await ctx.send(
+            "",
+            embed=NumEmbed(
+                title="Performance",
+                description="Latency percentiles (p50/p95/p99) since the bot started." if fields else "Nothing has been timed yet.",
+                fields=fields,
+                user=ctx.author,
+                footer_text="Restricted Cmd",
+            ),
+        )
+
+    @check(is_developer)
+    @command(aliases=["cpuprofile"])
+    async def profile(self, ctx, seconds: int = 10) -> None:
+        """
+        (DEVELOPER) Samples the event loop and stream threads for some seconds and sends a report of where they spent their time.
+        """
+        if self.profiling:
+            await ctx.send("⏳ A profile is already running.")
+            return
+        self.profiling = True
+
+        try:
+            seconds = max(1, min(seconds, 60))
+            threads = {get_ident(): "event-loop"}
+            threads.update({thread.ident: thread.name for thread in enumerate_threads() if thread.name in PROFILED_THREADS})
+
+            await ctx.send(f"⏳ Profiling {len(threads)} threads for {seconds}s...")
+            results = await self.bot.loop.run_in_executor(None, sample_threads, threads, seconds)
+            report = format_profile(results, seconds)
+        finally:
+            self.profiling = False
+
+        await ctx.send(
+            "",
+            file=File(BytesIO(report.encode("utf-8")), filename="profile.txt"),
+            embed=NumEmbed(
+                title="Profile",
+                description=f"Sampled {', '.join(results.keys())} for {seconds}s.",
+                user=ctx.author,
+                footer_text="Restricted Cmd",
+            ),
+        )
+
+    @check(is_developer)
+    @command(aliases=["memoryprofile"])
+    async def memprofile(self, ctx, seconds: int = 60) -> None:
+        """
+        (DEVELOPER) Compares the memory allocations from before and after some seconds and sends a report of what grew.
+        """
+        if self.profiling:
+            await ctx.send("⏳ A profile is already running.")
+            return
+        self.profiling = True
+
+        # Only stop tracing afterwards if it wasn't already running (tracing slows down allocations).
+        started_tracing = not tracemalloc.is_tracing()
+        try:
+            seconds = max(5, min(seconds, 600))
+            if started_tracing:
+                tracemalloc.start(25)
+
+            await ctx.send(f"⏳ Tracing memory allocations for {seconds}s...")
+            before = await self.bot.loop.run_in_executor(None, take_snapshot)
+            await sleep(seconds)
+            after = await self.bot.loop.run_in_executor(None, take_snapshot)
+            report = await self.bot.loop.run_in_executor(None, format_snapshot_diff, before, after, seconds)
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            self.profiling = False
+
+        # Add the sizes of the structures that are known to grow.
+        structure_sizes = {}
+        reactions = self.bot.get_cog("Reactions")
+        if reactions is not None:
+            structure_sizes["SpamProtection.event_count"] = len(reactions.spam_protection.event_count)
+            structure_sizes["Reactions.pending_selections"] = len(reactions.pending_selections)
+        assignment = self.bot.get_cog("Assignment")
+        if assignment is not None:
+            structure_sizes["Assignment.refused_already"] = len(assignment.refused_already)
+        structure_sizes["MemberIndex.by_discord"] = len(self.bot.member_index.by_discord)
+        structure_sizes["PointsLeaderboard.awarded"] = len(self.bot.points_leaderboard.awarded)
+        report += "\n\n-- Tracked structures --\n" + "\n".join(f"{name}: {size}" for name, size in structure_sizes.items())
+
+        await ctx.send(
+            "",
+            file=File(BytesIO(report.encode("utf-8")), filename="memprofile.txt"),
+            embed=NumEmbed(
+                title="Memory Profile",
+                description=f"Compared the memory allocations over {seconds}s.",
+                fields={name: size for name, size in structure_sizes.items()},
+                user=ctx.author,
+                footer_text="Restricted Cmd",
+            ),
+        )
+
+
+def setup(bot) -> None:
+    bot.add_cog(Developer(bot))
@@ -17,12 +17,41 @@ from discord.ext import commands
 
 import utils.errors as errors
 from utils.classes import NumEmbed
+from utils.checks import role_cache
 
 
 class EventHandler(commands.Cog):
     def __init__(self, bot) -> None:
         self.bot = bot
 
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after) -> None:
+        """
+        Clears a member's cached role IDs when they are updated.
+        """
+        role_cache.invalidate(after)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member) -> None:
+        """
+        Clears a member's cached role IDs when they leave.
+        """
+        role_cache.invalidate(member)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after) -> None:
+        """
+        Clears the guild's cached role IDs when one of its roles is updated.
+        """
+        role_cache.invalidate_guild(after.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role) -> None:
+        """
+        Clears the guild's cached role IDs when one of its roles is deleted.
+        """
+        role_cache.invalidate_guild(role.guild)
+
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error) -> None:
         """
@@ -15,9 +15,13 @@ limitations under the License.
 """
 from discord.ext.commands import Cog, command
 
-from requests import get
+from aiohttp import ClientError
+
+from asyncio import TimeoutError
 from random import randint, choice
 
+from utils.http import LRUCache
+from utils.metrics import metrics
 from utils.classes import NumEmbed
 
 
@@ -25,6 +29,10 @@ class Fun(Cog):
     def __init__(self, bot) -> None:
         self.bot = bot
 
+        # The facts fetched from the numbers API (by number).
+        self.fact_cache = LRUCache(max_size=512)
+        metrics.register_cache("numberfact", self.fact_cache)
+
     @command(aliases=["die", "roll"])
     async def dice(self, ctx) -> None:
         """
@@ -82,11 +90,21 @@ class Fun(Cog):
         """
         Get a fact about a random (or a specific) number.
         """
-        fetched_info = {}
-        if number is None:
-            fetched_info = get("http://numbersapi.com/random/math?default=No%20fact%20found.&json").json()
-        else:
-            fetched_info = get(f"http://numbersapi.com/{number}/math?default=No%20fact%20found.&json").json()
+        fetched_info = self.fact_cache.get(number) if number is not None else None
+        if fetched_info is None:
+            try:
+                fetched_info = await self.bot.web_client.get_json(
+                    f"http://numbersapi.com/{'random' if number is None else number}/math?default=No%20fact%20found.&json"
+                )
+                self.fact_cache.set(fetched_info["number"], fetched_info)
+            except (ClientError, TimeoutError, ValueError, KeyError):
+                # The numbers API is slow or unavailable, so make a fact locally instead.
+                number = randint(1, 1000) if number is None else number
+                fetched_info = {
+                    "number": number,
+                    "type": "math",
+                    "text": await self.bot.loop.run_in_executor(None, self.bot.numbers.checks.local_fact, number),
+                }
 
         await ctx.send(
             "",
@@ -49,7 +49,7 @@ class General(Cog):
         """
         Contact the Num moderators through Discord.
         """
-        num_guild = self.bot.get_guild(self.bot.settings.discord.main_guild)
+        num_guild = self.bot.get_guild(self.bot.settings.compiled.main_guild)
         guild_user = num_guild.get_member(ctx.author.id)
 
         # Check that the user is in the main guild.
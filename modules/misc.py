@@ -30,12 +30,23 @@ class Misc(Cog):
         """
         Give yourself a nickname.
         """
-        name_info = ctx.author.display_name.split(" | ")
-        number = int(name_info[0])
-        username = name_info[1]
+        identity = self.bot.member_index.get(ctx.author.id)
+        if identity is None:
+            await ctx.send(
+                "",
+                embed=NumEmbed(
+                    title="Nickname",
+                    description="Your Reddit account could not be found. Please contact the moderators.",
+                    colour="failure",
+                    user=ctx.author,
+                ),
+            )
+            return
+        username, number = identity
+        current_nickname = ctx.author.display_name
 
         # Load the nickname log channel.
-        nickname_log_channel = self.bot.get_channel(self.bot.settings.discord.ids["log_channels"]["nickname_log"])
+        nickname_log_channel = self.bot.get_channel(self.bot.settings.compiled.log_channels["nickname_log"])
 
         # Attempt to set the user's nickname.
         if nick is not None:
@@ -65,7 +76,7 @@ class Misc(Cog):
                         title="Failed Nickname Set (Too Long)",
                         colour="failure",
                         fields={
-                            "Current Nickname": " | ".join(name_info),
+                            "Current Nickname": current_nickname,
                             "Failed Nickname (Full)": new_nickname,
                             "Discord User": f"{ctx.author}\n{ctx.author.id}\n{ctx.author.mention}",
                         },
@@ -93,7 +104,7 @@ class Misc(Cog):
                     title="Successful Nickname Set",
                     colour="success",
                     fields={
-                        "Old Nickname": " | ".join(name_info),
+                        "Old Nickname": current_nickname,
                         "New Nickname": new_nickname,
                         "Discord User": f"{ctx.author}\n{ctx.author.id}\n{ctx.author.mention}",
                     },
@@ -111,7 +122,7 @@ class Misc(Cog):
                     colour="success",
                     fields={
                         "New Nickname": ctx.author.display_name,
-                        "Old Nickname": " | ".join(name_info),
+                        "Old Nickname": current_nickname,
                         "Discord User": f"{ctx.author}\n{ctx.author.id}\n{ctx.author.mention}",
                     },
                 ),
@@ -13,17 +13,21 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-from discord import TextChannel
+from discord import TextChannel, File
 from discord.ext.commands import Cog, command, check
 
 from typing import Optional
 
+from time import perf_counter
+from functools import partial
 from asyncio import TimeoutError
+from datetime import datetime, timedelta
 
 from utils.classes import NumEmbed
 from utils.numbers import is_allowed_number
 from utils.checks import is_in_main_guild, is_moderator, is_admin
-from utils.helpers import filter_username, upload_text, get_date_time
+from utils.export import EXPORT_FORMATS, export_numbers
+from utils.helpers import filter_username, upload_text, get_date_time, get_time, run_paced
 
 
 class Moderator(Cog):
@@ -32,23 +36,54 @@ class Moderator(Cog):
 
     @check(is_moderator)
     @command(aliases=["numbers", "numberlist"])
-    async def list(self, ctx):
+    async def list(self, ctx, export_format: str = "txt", backend: str = "file"):
         """
         (MOD) Gets a list of all the currently assigned numbers.
+        The format can be txt, csv or jsonl and the list can be sent as a file or uploaded to hastebin (paste).
         """
-        # Generate the list.
-        text = f"r/{self.bot.reddit.main_sub_name} Number List - {len(self.bot.numbers.numbers.keys())} Assigned - {get_date_time()} UTC"
-        for number, user in self.bot.numbers.numbers.items():
-            text += f"\n#{number} (u/{user})"
+        export_format = export_format.lower()
+        backend = backend.lower()
+        if export_format not in EXPORT_FORMATS or backend not in ("file", "paste"):
+            await ctx.send(
+                "",
+                embed=NumEmbed(
+                    title="Number List",
+                    description=f"The format must be one of {', '.join(EXPORT_FORMATS)} and the backend must be file or paste.",
+                    colour="failure",
+                    user=ctx.author,
+                    footer_text="Restricted Cmd",
+                ),
+            )
+            return
+
+        # Take a snapshot of the numbers so the list is consistent.
+        items = self.bot.numbers.snapshot()
+        title = f"r/{self.bot.reddit.main_sub_name} Number List - {len(items)} Assigned - {get_date_time()} UTC"
+
+        if backend == "file":
+            # Write the list into a compressed file (outside of the event loop) and send it.
+            compressed_list = await self.bot.loop.run_in_executor(None, export_numbers, items, export_format, title)
+            await ctx.send(
+                "",
+                file=File(compressed_list, filename=f"numbers-{get_time().strftime('%Y-%m-%d')}.{export_format}.gz"),
+                embed=NumEmbed(
+                    title="Number List",
+                    description=f"Generated a list of the {len(items)} current assigned numbers.",
+                    user=ctx.author,
+                    footer_text="Restricted Cmd",
+                ),
+            )
+            return
 
         # Attempt to upload the list and send a message if there was an error uploading it.
-        link = upload_text(text)
+        text = "".join(EXPORT_FORMATS[export_format](items, title))
+        link = await self.bot.loop.run_in_executor(None, upload_text, text)
         if link is None:
             await ctx.send(
                 "",
                 embed=NumEmbed(
                     title="Number List",
-                    description="There was an error uploading the list.\nPlease try again later.",
+                    description="There was an error uploading the list.\nPlease try again later (or use the file backend).",
                     colour="failure",
                     user=ctx.author,
                     footer_text="Restricted Cmd",
@@ -164,14 +199,24 @@ class Moderator(Cog):
     async def refresh(self, ctx):
         """
         (ADMIN) Refresh the Reddit wiki settings.
+        Only the parts of the bot that depend on the changed settings are reloaded.
         """
-        self.bot.settings.load_wiki_settings(self.bot.reddit)
-        self.bot.numbers.set_max_number()
+        changed = await self.bot.loop.run_in_executor(None, partial(self.bot.settings.load_wiki_settings, self.bot.reddit, notify=False))
+        self.bot.settings.notify(changed)
+
+        if not changed:
+            description = f"The Reddit wiki settings haven't changed (revision {self.bot.settings.revision_id})."
+        else:
+            changed_list = sorted(".".join(str(key) for key in path) for path in changed)
+            description = "Succesfully refreshed the Reddit wiki settings.\n\nChanged:\n" + "\n".join(f"• {path}" for path in changed_list[:15])
+            if len(changed_list) > 15:
+                description += f"\n...and {len(changed_list) - 15} more."
+
         await ctx.send(
             "",
             embed=NumEmbed(
                 title="Settings",
-                description="Succesfully refreshed the Reddit wiki settings.",
+                description=description,
                 colour="success",
                 user=ctx.author,
                 footer_text="Restricted Cmd",
@@ -184,15 +229,50 @@ class Moderator(Cog):
     async def purge(self, ctx, amount: int = 100):
         """
         (ADMIN) Delete a specified amount of messages from the current channel.
+        Messages younger than 14 days are bulk deleted (100 at a time) and older ones are deleted one by one.
         """
-        messages_deleted = 0
+        started = perf_counter()
+
+        # Split the (non-pinned) messages into ones that can be bulk deleted and ones that can't.
+        # Discord only allows bulk deleting messages younger than 14 days (a minute is left as a margin).
+        bulk_cutoff = datetime.utcnow() - timedelta(days=14, minutes=-1)
+        bulk_messages, old_messages = [], []
         async for message in ctx.channel.history(limit=amount):
-            # Ignore if the message is pinned.
-            if not message.pinned:
-                messages_deleted += 1
-                await message.delete()
+            if message.pinned:
+                continue
+            if message.created_at > bulk_cutoff:
+                bulk_messages.append(message)
+            else:
+                old_messages.append(message)
+
+        total = len(bulk_messages) + len(old_messages)
+        messages_deleted = 0
+        progress_message = await ctx.send(f"🗑️ Deleting {total} messages...")
 
-        await ctx.send(f"✅ Deleted {messages_deleted} messages!")
+        # Bulk delete the younger messages.
+        for i in range(0, len(bulk_messages), 100):
+            chunk = bulk_messages[i:i + 100]
+            try:
+                await ctx.channel.delete_messages(chunk)
+                messages_deleted += len(chunk)
+            except Exception as e:
+                print(f"MODERATOR: Error bulk deleting messages - {e}")
+            await progress_message.edit(content=f"🗑️ Deleted {messages_deleted}/{total} messages...")
+
+        # Delete the older messages one by one (paced to stay under the rate limit).
+        async def delete_old_message(message) -> None:
+            nonlocal messages_deleted
+            await message.delete()
+            messages_deleted += 1
+            if messages_deleted % 10 == 0:
+                await progress_message.edit(content=f"🗑️ Deleted {messages_deleted}/{total} messages (older messages are slower)...")
+
+        await run_paced(old_messages, delete_old_message, concurrency=1, delay=1.0)
+
+        await progress_message.edit(
+            content=f"✅ Deleted {messages_deleted} messages in {perf_counter() - started:.1f}s! "
+                    f"({len(bulk_messages)} bulk deleted, {len(old_messages)} older than 14 days)"
+        )
 
     @check(is_admin)
     @command(aliases=["msg", "message", "echo"])
@@ -14,14 +14,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 from discord.ext.commands import Cog
-from discord.ext.tasks import loop
 
 from textwrap import dedent
 
 from praw.models import TextArea
 
-from asyncio import sleep
-from datetime import timedelta
+from collections import Counter
+from random import choice
+from functools import partial
+from datetime import datetime, timedelta
 
 from utils.classes import NumEmbed
 from utils.numbers import get_number_nation
@@ -33,63 +34,273 @@ class NumberDayHandler(Cog):
         self.bot = bot
 
         self.widget_templates = self.bot.settings.templates.widgets
+        self.bot.settings.subscribe([("templates", "widgets")], self.reload_widget_templates)
+
+        # The parts of the next Num Day Update that are prepared before midnight.
+        self.prepared_update = None
+
+        # Register the timed jobs.
+        self.bot.scheduler.register("prepare_number_day_update", self.prepare_number_day_update, timedelta(days=1), offset=timedelta(hours=23, minutes=55))
+        self.update_job = self.bot.scheduler.register("number_day_update", self.number_day_update, timedelta(days=1), catch_up="all", on_catch_up=self.backfill_number_days)
+        self.bot.scheduler.register("compact_points_ledger", self.compact_points_ledger, timedelta(hours=6), catch_up="latest", jitter=60)
 
     @Cog.listener()
     async def on_ready(self) -> None:
-        # Start the number day update timer.
-        self.number_day_update.start()
-
         # Update the sidebar and widget.
         await self.update_widgets()
 
+    def reload_widget_templates(self, changed: set) -> None:
+        """
+        Reloads the widget templates (and updates the widgets with them).
+        """
+        self.widget_templates = self.bot.settings.templates.widgets
+        self.bot.loop.create_task(self.update_widgets())
+
     async def update_widgets(self) -> None:
         """
         Updates the sidebar and widget with the points leaderboard and current num day.
+        Unchanged content isn't rewritten and updates made close together are merged.
+        """
+        template_values = {
+            "num_day": get_num_day(),
+            "points_leaderboard": self.bot.points_leaderboard,
+            "subreddit": self.bot.settings.reddit.subreddit,
+            "assignment_thread": self.bot.settings.reddit.assignment.id,
+        }
+
+        # Update the sidebar widget and the main sidebar.
+        self.bot.publisher.publish("widget:sidebar", self.widget_templates["widget"].format(**template_values), self.write_widget)
+        self.bot.publisher.publish("wiki:config/sidebar", self.widget_templates["sidebar"].format(**template_values), self.write_sidebar)
+
+    def write_widget(self, text: str) -> None:
+        """
+        Writes the text of the sidebar widget.
         """
-        current_num_day = get_num_day()
-        points_leaderboard = self.bot.points_leaderboard
-
-        # Update the sidebar widget.
         widget = self.bot.reddit.main_subreddit.widgets.sidebar[0]
         if isinstance(widget, TextArea):
-            widget.mod.update(
-                text=self.widget_templates["widget"].format(
-                    num_day=current_num_day,
-                    points_leaderboard=points_leaderboard,
-                    subreddit=self.bot.settings.reddit.subreddit,
-                    assignment_thread=self.bot.settings.reddit.assignment.id,
-                )
-            )
+            widget.mod.update(text=text)
 
-        # Update the main sidebar.
-        self.bot.reddit.main_subreddit.wiki['config/sidebar'].edit(
-            self.widget_templates["sidebar"].format(
-                num_day=current_num_day,
-                points_leaderboard=points_leaderboard,
-                subreddit=self.bot.settings.reddit.subreddit,
-                assignment_thread=self.bot.settings.reddit.assignment.id,
-            )
+    def write_sidebar(self, text: str) -> None:
+        """
+        Writes the main (old Reddit) sidebar.
+        """
+        self.bot.reddit.main_subreddit.wiki["config/sidebar"].edit(text)
+
+    def get_statistics_parts(self, items: list) -> dict:
+        """
+        Gets the statistics used in the Num Day Update submission.
+        :param items: A snapshot of the assigned numbers.
+        :return: The statistics (keyed by their template names).
+        """
+        number_statistics = self.bot.numbers.calculate_statistics(items)
+        return {
+            "stats_assigned": number_statistics["numbers_given"],
+            "stats_odd": number_statistics["odds"],
+            "stats_even": number_statistics["evens"],
+            "stats_mean": number_statistics["mean"],
+            "stats_median": number_statistics["median"],
+            "stats_sum": number_statistics["sum"],
+        }
+
+    def get_nation_distribution(self, items: list) -> dict:
+        """
+        Gets the amount of assigned numbers in each nation.
+        :param items: A snapshot of the assigned numbers.
+        :return: The amount of numbers in each nation.
+        """
+        return dict(Counter(get_number_nation(number) for number, _ in items))
+
+    def record_statistics(self, prepared: dict, due: datetime) -> None:
+        """
+        Records the statistics of a prepared update in the statistics history.
+        :param prepared: The prepared update.
+        :param due: The time the update is for.
+        """
+        parts = prepared["template_parts"]
+        self.bot.statistics_history.record(
+            prepared["num_day"],
+            get_date(due),
+            {
+                "count": parts["stats_assigned"],
+                "sum": parts["stats_sum"],
+                "mean": parts["stats_mean"],
+                "median": parts["stats_median"],
+                "odds": parts["stats_odd"],
+                "evens": parts["stats_even"],
+            },
+            prepared["nations"],
         )
 
-    @loop(count=1)
-    async def number_day_update(self) -> None:
+    def get_recorded_statistics_parts(self, num_day: int) -> dict:
         """
-        This updates the number day and assigns the daily points.
+        Gets the statistics recorded in the history for a Num Day (in the format of get_statistics_parts).
+        :return: The statistics (or None if none were recorded).
         """
-        current_date = get_date()
-        current_num_day = get_num_day()
+        recorded = self.bot.statistics_history.get(num_day)
+        if recorded is None:
+            return None
+        return {
+            "stats_assigned": recorded["count"],
+            "stats_odd": recorded["odds"],
+            "stats_even": recorded["evens"],
+            "stats_mean": recorded["mean"],
+            "stats_median": recorded["median"],
+            "stats_sum": recorded["sum"],
+        }
+
+    async def run_prepare_update(self, num_day: int) -> dict:
+        """
+        Prepares the parts of a Num Day Update in an executor (from a snapshot of the numbers taken on the loop).
+        :param num_day: The Num Day that the update is for.
+        :return: The prepared parts of the update.
+        """
+        numbers_version = self.bot.numbers.version
+        items = self.bot.numbers.snapshot()
+        return await self.bot.loop.run_in_executor(None, self.prepare_update, num_day, items, numbers_version)
 
+    def prepare_update(self, num_day: int, items: list, numbers_version: int) -> dict:
+        """
+        Prepares the parts of a Num Day Update that don't depend on the day's submissions.
+        :param num_day: The Num Day that the update is for.
+        :param items: A snapshot of the assigned numbers.
+        :param numbers_version: The version of the numbers when the snapshot was taken.
+        :return: The prepared parts of the update.
+        """
         # Get a random user for Number of the Day.
-        notd, notd_user = self.bot.numbers.generation.get_random_user()
+        notd, notd_user = choice(items)
+
+        return {
+            "num_day": num_day,
+            "numbers_version": numbers_version,
+            "notd": notd,
+            "notd_user": notd_user,
+            "nations": self.get_nation_distribution(items),
+            "template_parts": {
+                "num_day": num_day,
+                "notd": notd,
+                "notd_user": notd_user,
+
+                # Statistics
+                **self.get_statistics_parts(items),
+
+                "subreddit": self.bot.settings.reddit.subreddit,
+                "assignment_thread": self.bot.settings.reddit.assignment.id,
+            },
+        }
+
+    def find_posted_update(self, title: str):
+        """
+        Finds a Num Day Update that the bot has already posted (so that a retried update isn't posted twice).
+        :param title: The title of the update.
+        :return: The submission (or None if it hasn't been posted).
+        """
+        subreddit = self.bot.settings.reddit.subreddit.lower()
+        for submission in self.bot.reddit.user.me().submissions.new(limit=25):
+            if submission.title == title and submission.subreddit.display_name.lower() == subreddit:
+                return submission
+        return None
 
-        # Get the statistics for the currently assigned numbers.
-        number_statistics = self.bot.numbers.statistics
+    def get_top_submissions(self, since: datetime = None, until: datetime = None) -> list:
+        """
+        Gets the top 3 submissions of the day (ignoring the bot's own submissions).
+        :param since: Optional. The start of an older period to get the top submissions of (used when backfilling).
+        :param until: Optional. The end of that period.
+        :return: The submissions.
+        """
+        if since is None:
+            listing = self.bot.reddit.main_subreddit.top("day", limit=4)
+        else:
+            # Use the smallest top listing that covers the period, and filter it down to the period.
+            age = get_time() - since
+            time_filter = "week" if age <= timedelta(days=7) else "month" if age <= timedelta(days=31) else "year"
+            listing = (
+                submission for submission in self.bot.reddit.main_subreddit.top(time_filter, limit=None)
+                if since.timestamp() <= submission.created_utc < until.timestamp()
+            )
 
-        # Assign points for the top 3 submissions of the day.
         submissions = []
-        for submission in self.bot.reddit.main_subreddit.top("day", limit=4):
-            if submission.author.name != self.bot.reddit.username:
+        for submission in listing:
+            if submission.author is not None and submission.author.name != self.bot.reddit.username:
                 submissions.append(submission)
+                if len(submissions) == 3:
+                    break
+        return submissions
+
+    async def prepare_number_day_update(self, due: datetime) -> None:
+        """
+        Prepares the next Num Day Update a few minutes before midnight.
+        """
+        self.prepared_update = await self.run_prepare_update(get_num_day(due) + 1)
+
+        # Record the statistics now in case the update has to be backfilled.
+        self.record_statistics(self.prepared_update, due + timedelta(days=1))
+
+        print("NUMBER DAY: Prepared the next update.")
+
+    async def backfill_number_days(self, missed: list) -> None:
+        """
+        Does the Num Day Updates that were missed while the bot was down (in order).
+        It stops at the first update that fails (which is left unrecorded so that it is retried when the bot next starts,
+        without being posted again if it was posted before failing).
+        The leaderboard is saved and the widgets are updated once at the end.
+        :param missed: The times of the missed updates.
+        """
+        backfilled = 0
+        try:
+            for due in missed:
+                await self.number_day_update(due, backfill=True)
+                backfilled += 1
+        except Exception as e:
+            print(f"NUMBER DAY: Failed to backfill Num Day #{get_num_day(missed[backfilled])}, stopping - {e}")
+            raise
+        finally:
+            await self.bot.loop.run_in_executor(None, self.bot.points_leaderboard.save)
+            await self.update_widgets()
+            print(f"NUMBER DAY: Backfilled {backfilled} of {len(missed)} update(s).")
+
+    async def number_day_update(self, due: datetime, backfill: bool = False) -> None:
+        """
+        This updates the number day and assigns the daily points.
+        :param due: The time the update was scheduled for.
+        :param backfill: Whether this is a missed update being done late.
+        """
+        current_date = get_date(due)
+        current_num_day = get_num_day(due)
+
+        # Use the parts prepared before midnight (preparing them now if they're missing).
+        prepared = self.prepared_update
+        self.prepared_update = None
+        statistics_missing = False
+        if prepared is None or prepared["num_day"] != current_num_day:
+            prepared = await self.run_prepare_update(current_num_day)
+
+            # Use the statistics recorded for that day if the update is being backfilled.
+            if backfill:
+                recorded_parts = self.get_recorded_statistics_parts(current_num_day)
+                if recorded_parts is not None:
+                    prepared["template_parts"].update(recorded_parts)
+                else:
+                    # The bot was down when they would have been recorded, so flag that the current ones are used.
+                    statistics_missing = True
+                    print(f"NUMBER DAY: No statistics were recorded for Num Day #{current_num_day}, using the current ones.")
+        else:
+            # Make sure the Number of the Day still belongs to the same user.
+            if self.bot.numbers.search.num_to_user(prepared["notd"]) != prepared["notd_user"]:
+                prepared = await self.run_prepare_update(current_num_day)
+
+            # Refresh the statistics if numbers were assigned after they were prepared.
+            elif prepared["numbers_version"] != self.bot.numbers.version:
+                items = self.bot.numbers.snapshot()
+                prepared["template_parts"].update(await self.bot.loop.run_in_executor(None, self.get_statistics_parts, items))
+                prepared["nations"] = self.get_nation_distribution(items)
+
+        notd, notd_user = prepared["notd"], prepared["notd_user"]
+
+        # Assign points for the top 3 submissions of the day.
+        if backfill:
+            submissions = await self.bot.loop.run_in_executor(None, self.get_top_submissions, due - timedelta(days=1), due)
+        else:
+            submissions = await self.bot.loop.run_in_executor(None, self.get_top_submissions)
 
         assigned_points_text = dedent("""
             |**Submission**|**Username**|**Nation**|**Points Awarded**|
@@ -99,7 +310,6 @@ class NumberDayHandler(Cog):
 
         points_leaderboard = self.bot.points_leaderboard
 
-        submissions = submissions[:3]
         for submission in submissions:
             try:
                 username = submission.author.name
@@ -110,8 +320,9 @@ class NumberDayHandler(Cog):
                 elif username == "OneUpPotato":
                     user_nation = "000s"
 
-                # Increase the points for that nation.
-                points_leaderboard.leaderboard[user_nation] += 1
+                # Award the points to that nation (skipping submissions that have already been awarded).
+                if not points_leaderboard.award(current_num_day, submission.id, user_nation):
+                    continue
 
                 assigned_points_text += "\n" + assigned_points_row.format(
                     title=submission.title,
@@ -126,32 +337,37 @@ class NumberDayHandler(Cog):
         if len(submissions) == 0:
             assigned_points_text = "No points have been assigned today."
 
+        # Write the awards to the ledger before they are posted.
+        await self.bot.loop.run_in_executor(None, points_leaderboard.write_ledger)
+
         # Post the Num Day Update submission.
         submission_text = self.bot.settings.templates.num_day_update["submission_text"].format(
-            num_day=current_num_day,
-            notd=notd,
-            notd_user=notd_user,
-
-            # Statistics
-            stats_assigned=number_statistics["numbers_given"],
-            stats_odd=number_statistics["odds"],
-            stats_even=number_statistics["evens"],
-            stats_mean=number_statistics["mean"],
-            stats_median=number_statistics["median"],
-            stats_sum=number_statistics["sum"],
+            **prepared["template_parts"],
 
             points_leaderboard_text=points_leaderboard.leaderboard_table(header=False),
             new_assigned_points_text=assigned_points_text.strip(),
-
-            subreddit=self.bot.settings.reddit.subreddit,
-            assignment_thread=self.bot.settings.reddit.assignment.id,
         )
+        if statistics_missing:
+            submission_text = (
+                f"*This update was posted late, so its statistics are from {get_date(get_time())} rather than {current_date}.*\n\n"
+                + submission_text
+            )
 
-        submission = self.bot.reddit.main_subreddit.submit(f"Daily Update ({current_date}) - Day #{current_num_day}", selftext=submission_text)
+        # Post the update (unless a previous attempt at it already did before failing).
+        title = f"Daily Update ({current_date}) - Day #{current_num_day}"
+        submission = await self.bot.loop.run_in_executor(None, self.find_posted_update, title)
+        if submission is None:
+            submission = await self.bot.loop.run_in_executor(
+                None,
+                partial(self.bot.reddit.main_subreddit.submit, title, selftext=submission_text),
+            )
+        else:
+            print(f"NUMBER DAY: Num Day #{current_num_day} has already been posted, so it won't be posted again.")
 
         # Send a message to the Number of the Day feed on Discord.
-        notd_channel = self.bot.get_channel(self.bot.settings.discord.ids["feed_channels"]["notd"])
-        notd_ping = f"<@&{self.bot.settings.discord.role_ids.ping_notifications['Number of the Day']}>"
+        notd_channel = self.bot.get_channel(self.bot.settings.compiled.feed_channels["notd"])
+        # Don't ping for late updates.
+        notd_ping = "" if backfill else f"<@&{self.bot.settings.compiled.ping_roles['Number of the Day']}>"
         await notd_channel.send(
             notd_ping,
             embed=NumEmbed(
@@ -165,24 +381,21 @@ class NumberDayHandler(Cog):
             ),
         )
 
-        # Save the updated leaderboard and update the widgets.
-        points_leaderboard.save()
-        await self.update_widgets()
+        # Save the updated leaderboard and update the widgets (a backfill does this once it has finished).
+        if not backfill:
+            self.record_statistics(prepared, due)
+            points_leaderboard.queue_save()
+            await self.update_widgets()
+
+        # Record the run now that the update is done (so that a failed update is retried when it is next caught up on).
+        self.bot.scheduler.record_run(self.update_job, due)
+        print(f"NUMBER DAY: Updated Num Day #{current_num_day}.")
 
-    @number_day_update.before_loop
-    async def before_number_day_update(self) -> None:
+    async def compact_points_ledger(self, due: datetime) -> None:
         """
-        Wait until midnight UTC before doing the number day update.
+        Compacts the points ledger and saves the leaderboard to the wiki.
         """
-        current_time = get_time()
-        time_remaining = (timedelta(hours=24) - (current_time - current_time.replace(hour=0, minute=0, second=0, microsecond=0))).total_seconds() % (24 * 3600)
-        await sleep(time_remaining)
-        await self.bot.wait_until_ready()
-
-    @number_day_update.after_loop
-    async def after_number_day_update(self) -> None:
-        print("NUMBER DAY: Updated. Starting the timer again.")
-        self.number_day_update.restart()
+        await self.bot.loop.run_in_executor(None, self.bot.points_leaderboard.compact)
 
 
 def setup(bot) -> None:
@@ -13,10 +13,14 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-from discord.ext.commands import Cog, command
+from discord import Member
+from discord.ext.commands import Cog, command, check
+
+from typing import Union
 
 from utils.classes import NumEmbed
-from utils.helpers import filter_username
+from utils.helpers import filter_username, get_num_day
+from utils.checks import is_in_main_guild
 
 
 class Numbers(Cog):
@@ -55,6 +59,69 @@ class Numbers(Cog):
             ),
         )
 
+    @command(aliases=["trends", "history"])
+    async def trend(self, ctx, days: int = 7) -> None:
+        """
+        Shows how the number statistics have changed over the last few days.
+        """
+        days = max(2, min(days, 365))
+        history = self.bot.statistics_history.latest(days, get_num_day())
+        if len(history) < 2:
+            await ctx.send(
+                "",
+                embed=NumEmbed(
+                    title="Number Trends",
+                    description="There isn't enough recorded history yet.",
+                    colour="failure",
+                    user=ctx.author,
+                ),
+            )
+            return
+
+        first, last = history[0], history[-1]
+
+        def change(key: str, decimals: int = 0) -> str:
+            difference = last[key] - first[key]
+            return f"{last[key]:.{decimals}f} ({difference:+.{decimals}f})"
+
+        # Find the nations whose amount of numbers changed the most.
+        first_nations = self.bot.statistics_history.nations(first["num_day"])
+        last_nations = self.bot.statistics_history.nations(last["num_day"])
+        nation_changes = sorted(
+            ((nation, count - first_nations.get(nation, 0)) for nation, count in last_nations.items()),
+            key=lambda nation_change: -abs(nation_change[1]),
+        )
+        nations_text = "\n".join(
+            f"{nation}: {last_nations[nation]} ({difference:+d})" for nation, difference in nation_changes[:5]
+        )
+
+        # Mention any days in the period that have no recorded statistics (such as when the bot was down).
+        description = f"Day #{first['num_day']} ({first['date']}) to Day #{last['num_day']} ({last['date']})."
+        missing_days = (last["num_day"] - first["num_day"] + 1) - len(history)
+        if missing_days:
+            description += f"\n{missing_days} day(s) in this period have no recorded statistics."
+
+        await ctx.send(
+            "",
+            embed=NumEmbed(
+                title="Number Trends",
+                description=description,
+                colour=0x007E80,
+                fields={
+                    "Numbers Given": change("count"),
+                    "Even Numbers": change("evens"),
+                    "Odd Numbers": change("odds"),
+
+                    "Sum of Numbers": change("sum"),
+                    "Mean": change("mean", 2),
+                    "Median": change("median", 1),
+
+                    "Nations": nations_text or "No nation data.",
+                },
+                user=ctx.author,
+            ),
+        )
+
     @command(aliases=["num", "check", "nation", "country", "countries", "search"])
     async def number(self, ctx, number: int) -> None:
         """
@@ -114,6 +181,51 @@ class Numbers(Cog):
             ),
         )
 
+    @check(is_in_main_guild)
+    @command(aliases=["whoami"])
+    async def whois(self, ctx, user: Union[Member, filter_username] = None):
+        """
+        See which Reddit user a Discord member is (or which Discord member a Reddit user is).
+        """
+        if user is None:
+            user = ctx.author
+
+        # Look the user up in the member index (in whichever direction is needed).
+        if isinstance(user, Member):
+            member = user
+            identity = self.bot.member_index.get(member.id)
+        else:
+            member_id = self.bot.member_index.find_member_id(user)
+            member = ctx.guild.get_member(member_id) if member_id is not None else None
+            identity = self.bot.member_index.get(member_id)
+
+        if member is None or identity is None:
+            await ctx.send(
+                "",
+                embed=NumEmbed(
+                    title="NGB - Who Is",
+                    description="That user isn't verified on this server.",
+                    colour=0x3CBD70,
+                    user=ctx.author,
+                ),
+            )
+            return
+
+        username, number = identity
+        await ctx.send(
+            "",
+            embed=NumEmbed(
+                title="NGB - Who Is",
+                colour=0x3CBD70,
+                fields={
+                    "Discord User": f"{member}\n{member.mention}",
+                    "Username": f"u/{username}",
+                    "Number": f"#{number}" if number is not None else "No Number",
+                },
+                user=ctx.author,
+            ),
+        )
+
     @command(aliases=["lb", "points", "pointsleaderboard"])
     async def leaderboard(self, ctx) -> None:
         """
@@ -13,17 +13,45 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-from discord import User, Member, Message
-from discord.utils import get
+from discord import Member, Message, HTTPException
 from discord.ext.commands import Cog, command, check
 
-from typing import Union
+from time import monotonic
+from asyncio import sleep, Lock
 from textwrap import dedent
 
 from utils.classes import NumEmbed, SpamProtection
+from utils.helpers import roles_from_ids, run_paced
+from utils.metrics import metrics
 from utils.checks import is_in_main_guild, is_developer
 
 
+class SelectionBatch:
+    """
+    Holds the reaction role changes a user has made in a short window, so that they can be applied together.
+    """
+    def __init__(self, user: Member) -> None:
+        self.user = user
+        self.changes = {}
+
+        self.first_event = monotonic()
+        self.last_event = self.first_event
+
+    def add_change(self, category: str, role_name: str, added: bool, message: Message, emoji: str) -> None:
+        """
+        Record a reaction being added or removed.
+        :param category: The specific category of reaction role (e.g ping notifications).
+        :param role_name: The role (name) the reaction is for.
+        :param added: Whether the reaction was added (or removed).
+        :param message: The reaction role category message.
+        :param emoji: The emoji reacted with (used if the reaction needs to be removed).
+        """
+        # Re-insert the change so that the most recent click for a role is applied last.
+        self.changes.pop((category, role_name), None)
+        self.changes[(category, role_name)] = {"added": added, "message": message, "emoji": emoji}
+        self.last_event = monotonic()
+
+
 class Reactions(Cog):
     def __init__(self, bot) -> None:
         self.bot = bot
@@ -34,12 +62,36 @@ class Reactions(Cog):
             "ping_notifications": "Ping Notification",
         }
 
+        self.load_settings()
+        self.bot.settings.subscribe(
+            [("discord", "role_ids"), ("discord", "ids", "selection"), ("discord", "reaction_roles")],
+            lambda changed: self.load_settings(),
+        )
+
+        self.spam_protection = SpamProtection()
+
+        # Reaction role changes are collected per user and applied together once they stop reacting.
+        self.pending_selections = {}
+        metrics.register_gauge("tng_queue_depth", lambda: len(self.pending_selections), queue="pending_selections")
+        self.selection_debounce = 3
+        self.selection_max_wait = 10
+
+        # Batches are applied one at a time per user (the lock and the amount of batches using it).
+        self.selection_locks = {}
+
+        # The reactions the bot has removed itself (so the removal events they cause are ignored).
+        self.bot_removals = set()
+
+        self.reconciled = False
+
+    def load_settings(self) -> None:
+        """
+        Loads the reaction role maps from the settings.
+        """
         self.role_ids = self.bot.settings.discord.role_ids.role_ids
         self.selection_ids = self.bot.settings.discord.ids["selection"]
         self.reaction_to_role = self.bot.settings.discord.reaction_roles
 
-        self.spam_protection = SpamProtection()
-
     @check(is_developer)
     @check(is_in_main_guild)
     @command()
@@ -64,150 +116,277 @@ class Reactions(Cog):
         # React to the command message when finished.
         await ctx.message.add_reaction("👍")
 
-    async def reaction_role_add(self, user: Union[User, Member], role_name: str, category: str, message: Message, emoji: str):
+    async def remove_user_reaction(self, message: Message, emoji: str, user: Member) -> bool:
+        """
+        Removes a user's reaction without it being treated as the user deselecting a role.
+        A failed removal (such as the reaction already being gone) is logged rather than raised,
+        so that the rest of a batch is still applied.
+        :return: Whether the reaction was removed.
         """
-        Handles adding a reaction role after being called from the reaction event.
-        :param user: The user who to remove a role from.
-        :param role_name: The role (name) to validate eligiblity for (and possibly add to the user).
+        key = (message.id, user.id, emoji)
+        self.bot_removals.add(key)
+        try:
+            await message.remove_reaction(emoji, user)
+        except HTTPException as e:
+            self.bot_removals.discard(key)
+            print(f"REACTIONS: Failed to remove a reaction of {user} - {e}")
+            return False
+        except Exception:
+            self.bot_removals.discard(key)
+            raise
+        return True
+
+    def queue_selection(self, user: Member, role_name: str, category: str, message: Message, emoji: str, added: bool) -> None:
+        """
+        Queues a reaction role change. Changes are applied together once the user stops reacting for a short while.
+        :param user: The user who reacted.
+        :param role_name: The role (name) the reaction is for.
         :param category: The specific category of reaction role (e.g ping notifications).
         :param message: The reaction role category message.
         :param emoji: The emoji reacted with (used if the reaction needs to be removed).
+        :param added: Whether the reaction was added (or removed).
         """
-        name_info = user.display_name.split(" | ")
-        number = int(name_info[0])
-
-        # Load the log channel.
-        log_channel = self.bot.get_channel(self.bot.settings.discord.ids["log_channels"]["selection_logs"][category])
-
-        # If the role category is a country then check if they are eligible.
-        if category == "countries":
-            if not self.bot.numbers.checks.is_eligible_for(number, role_name):
-                # The user is not eligible. Attempt to send a message to them and then the log channel.
-                try:
-                    await user.send(f"Your number is not eligible for the '{role_name}' role.")
-                except Exception:
-                    pass
-                finally:
-                    await log_channel.send(
-                        "",
-                        embed=NumEmbed(
-                            title=f"(Failed) {self.singular_names[category]} Join",
-                            description="That user is not eligible for this role.",
-                            colour=0xFFFF00,
-                            fields={
-                                "Number": number,
-                                "Username": f"u/{name_info[1]}",
-                                "Discord User": f"@{user}\n{user.mention}\nID: {user.id}",
-                                "Role": role_name,
-                            },
-                        ),
-                    )
+        batch = self.pending_selections.get(user.id)
+        if batch is None:
+            batch = self.pending_selections[user.id] = SelectionBatch(user)
+            self.bot.loop.create_task(self.flush_selection(user.id))
 
-                # Remove their reaction.
-                await message.remove_reaction(emoji, user)
-
-                return
-
-        # If the role is a country then ensure they are not at the country limit.
-        if category == "countries":
-            current_countries = [role.id for role in user.roles if role.id in self.role_ids[category].values()]
-            if len(current_countries) >= 2:
-                # The user is already at the maximum amount of countries.
-                try:
-                    await user.send(f"Failed to join '{role_name}'. You are already in two countries, leave one and try again.")
-                except Exception:
-                    pass
-                finally:
-                    await log_channel.send(
-                        "",
-                        embed=NumEmbed(
-                            title=f"(Failed) {self.singular_names[category]} Join",
-                            description="That user is already at the maximum amount of countries.",
-                            colour=0xFFFF00,
-                            fields={
-                                "Number": number,
-                                "Username": f"u/{name_info[1]}",
-                                "Discord User": f"@{user}\n{user.mention}\nID: {user.id}",
-                                "Role": role_name,
-                            },
-                        ),
-                    )
+        batch.user = user
+        batch.add_change(category, role_name, added, message, emoji)
 
-                # Remove their reaction.
-                await message.remove_reaction(emoji, user)
+    async def flush_selection(self, user_id: int) -> None:
+        """
+        Waits until a user's selection batch has settled and then applies it.
+        :param user_id: The id of the user whose batch to apply.
+        """
+        batch = self.pending_selections[user_id]
+
+        # Wait until no reactions have been made for the debounce window (or the maximum wait has been reached).
+        while True:
+            remaining = min(
+                batch.last_event + self.selection_debounce,
+                batch.first_event + self.selection_max_wait,
+            ) - monotonic()
+            if remaining <= 0:
+                break
+            await sleep(remaining)
 
-                return
+        del self.pending_selections[user_id]
 
-        # Fetch the role and then assign it to the user.
-        role = get(message.guild.roles, id=self.role_ids[category][role_name])
-        await user.add_roles(role)
+        # Mark a single event for the whole batch.
+        self.spam_protection.mark_event(batch.user)
+
+        # Wait for any earlier batch of the user's to finish being applied (so it isn't applied over stale roles).
+        lock, users = self.selection_locks.get(user_id, (None, 0))
+        if lock is None:
+            lock = Lock()
+        self.selection_locks[user_id] = (lock, users + 1)
 
-        # Attempt to send a message to the user, then send a message to the log channel.
         try:
-            await user.send(f"Succesfully added the '{role_name}' role.")
-        except Exception:
-            pass
+            async with lock:
+                # Use the member's latest roles.
+                batch.user = batch.user.guild.get_member(user_id) or batch.user
+                await self.apply_selection(batch)
+        except Exception as e:
+            self.bot.sentry.capture_exception(e)
+            print(f"REACTIONS: Failed to apply a selection for {batch.user} - {e}")
         finally:
-            await log_channel.send(
-                "",
-                embed=NumEmbed(
-                    title=f"{self.singular_names[category]} Join",
-                    colour="success",
-                    fields={
-                        "Number": number,
-                        "Username": f"u/{name_info[1]}",
-                        "Discord User": f"@{user}\n{user.mention}\nID: {user.id}",
-                        "Role": role_name,
-                    },
-                ),
-            )
+            lock, users = self.selection_locks[user_id]
+            if users == 1:
+                del self.selection_locks[user_id]
+            else:
+                self.selection_locks[user_id] = (lock, users - 1)
 
-    async def reaction_role_remove(self, user: Union[User, Member], role_name: str, category: str, message: Message):
+    async def apply_selection(self, batch: SelectionBatch) -> None:
         """
-        Handles removing a role upon a reaction being removed.
-        :param user: The user who to remove a role from.
-        :param role_name: The role (name) to remove.
-        :param category: The specific category of reaction role (e.g ping notifications).
-        :param message: The reaction role category message.
+        Applies a user's batched reaction role changes using a single role edit.
+        :param batch: The batch of changes to apply.
         """
-        name_info = user.display_name.split(" | ")
-        number = int(name_info[0])
+        user = batch.user
 
-        # Ignore the reaction removal if the user was never eligible for the role.
-        if category == "countries":
-            if not self.bot.numbers.checks.is_eligible_for(number, role_name):
-                return
-
-        # Fetch the role.
-        role = get(message.guild.roles, id=self.role_ids[category][role_name])
-
-        # Ignore if the user never had the role.
-        if role not in user.roles:
+        # Only verified (indexed) members can select roles.
+        identity = self.bot.member_index.get(user.id)
+        if identity is None:
+            return
+        username, number = identity
+
+        # Work out the user's desired roles (all of the removals are applied before the additions).
+        current_role_ids = {role.id for role in user.roles}
+        desired_role_ids = set(current_role_ids)
+        country_role_ids = set(self.role_ids["countries"].values())
+
+        for (category, role_name), change in batch.changes.items():
+            if not change["added"]:
+                desired_role_ids.discard(self.role_ids[category][role_name])
+
+        failed = {}
+        rejected = []
+        new_countries = []
+        for (category, role_name), change in batch.changes.items():
+            if not change["added"]:
+                continue
+            role_id = self.role_ids[category][role_name]
+
+            # Countries can only be joined if the user's number is eligible for them.
+            if category == "countries":
+                if number is None or not self.bot.numbers.checks.is_eligible_for(number, role_name):
+                    rejected.append((category, role_name, "not eligible", change))
+                elif role_id not in desired_role_ids:
+                    new_countries.append((role_name, role_id, change))
+                continue
+
+            desired_role_ids.add(role_id)
+
+        # Check the country limit once against the final roles (the earliest picks are kept).
+        free_slots = max(0, 2 - len(desired_role_ids & country_role_ids))
+        for role_name, role_id, change in new_countries[:free_slots]:
+            desired_role_ids.add(role_id)
+        for role_name, role_id, change in new_countries[free_slots:]:
+            rejected.append(("countries", role_name, "already in two countries", change))
+
+        # Remove the reactions of the rejected picks.
+        for category, role_name, failure_reason, change in rejected:
+            failed.setdefault(category, []).append(f"{role_name} ({failure_reason})")
+            await self.remove_user_reaction(change["message"], change["emoji"], user)
+
+        # Find which roles were actually joined or left.
+        joined = {}
+        left = {}
+        for category, role_name in batch.changes.keys():
+            role_id = self.role_ids[category][role_name]
+            if role_id in desired_role_ids and role_id not in current_role_ids:
+                joined.setdefault(category, []).append(role_name)
+            elif role_id in current_role_ids and role_id not in desired_role_ids:
+                left.setdefault(category, []).append(role_name)
+
+        if not (joined or left or failed):
             return
 
-        # Remove the role from the user.
-        await user.remove_roles(role)
+        # Apply all of the role changes in one edit.
+        if desired_role_ids != current_role_ids:
+            await user.edit(roles=roles_from_ids(user.guild, desired_role_ids))
+
+        # Attempt to send a summary to the user, then send a message to the log channel(s).
+        summary = []
+        for name, changes in [("Joined", joined), ("Left", left), ("Failed to join", failed)]:
+            role_names = [role_name for category_roles in changes.values() for role_name in category_roles]
+            if role_names:
+                summary.append(f"**{name}:** {', '.join(role_names)}")
+        if failed.get("countries"):
+            summary.append("You can only join countries your number is eligible for, and up to two of them.")
 
-        # Attempt to send a message to the user, then send a message to the log channel.
         try:
-            await user.send(f"Removed the '{role_name}' role from you.")
+            await user.send("\n".join(summary))
         except Exception:
             pass
         finally:
-            log_channel = self.bot.get_channel(self.bot.settings.discord.ids["log_channels"]["selection_logs"][category])
-            await log_channel.send(
-                "",
-                embed=NumEmbed(
-                    title=f"{self.singular_names[category]} Left",
-                    colour="failure",
-                    fields={
-                        "Number": number,
-                        "Username": f"u/{name_info[1]}",
-                        "Discord User": f"@{user}\n{user.mention}\nID: {user.id}",
-                        "Role": role_name,
-                    },
-                ),
-            )
+            for category in self.singular_names.keys():
+                if category not in joined and category not in left and category not in failed:
+                    continue
+
+                fields = {
+                    "Number": number,
+                    "Username": f"u/{username}",
+                    "Discord User": f"@{user}\n{user.mention}\nID: {user.id}",
+                }
+                if category in joined:
+                    fields["Joined"] = "\n".join(joined[category])
+                if category in left:
+                    fields["Left"] = "\n".join(left[category])
+                if category in failed:
+                    fields["Failed"] = "\n".join(failed[category])
+
+                log_channel = self.bot.get_channel(self.bot.settings.compiled.selection_log_channels[category])
+                await log_channel.send(
+                    "",
+                    embed=NumEmbed(
+                        title=f"{self.singular_names[category]} Selection",
+                        colour="success" if category not in failed else 0xFFFF00,
+                        fields=fields,
+                    ),
+                )
+
+    async def reconcile_selections(self) -> None:
+        """
+        Brings members' reaction roles back in line with the selection messages.
+        This handles any reactions that were added or removed while the bot was offline.
+        """
+        guild = self.bot.get_guild(self.bot.settings.compiled.main_guild)
+        verified_role_id = self.bot.settings.compiled.verified_role
+
+        # The member index is needed to find members' numbers.
+        self.bot.member_index.build(guild.members, verified_role_id)
+
+        # Page through the reactors of each selection message.
+        messages = {}
+        reactors = {}
+        for category, emoji_to_role in self.reaction_to_role.items():
+            messages[category] = await self.bot.get_channel(self.selection_ids["channel"][category]).fetch_message(self.selection_ids["message"][category])
+            reactors[category] = {}
+            for reaction in messages[category].reactions:
+                if str(reaction.emoji) in emoji_to_role.keys():
+                    reactors[category][str(reaction.emoji)] = {user.id async for user in reaction.users()}
+
+        # Work out the fixes needed for each verified member.
+        fixes = []
+        for member in guild.members:
+            current_role_ids = {role.id for role in member.roles}
+            if verified_role_id not in current_role_ids:
+                continue
+
+            # Members who aren't indexed are left alone (like when they select roles), as their number isn't known.
+            identity = self.bot.member_index.get(member.id)
+            if identity is None:
+                continue
+            number = identity[1]
+
+            target_role_ids = set(current_role_ids)
+            rejected = []
+            for category, emoji_to_role in self.reaction_to_role.items():
+                reacted_countries = []
+                for emoji, role_name in emoji_to_role.items():
+                    role_id = self.role_ids[category][role_name]
+                    reacted = member.id in reactors[category].get(emoji, ())
+
+                    # Countries can only be kept if the member's number is eligible for them.
+                    if reacted and category == "countries":
+                        if number is None or not self.bot.numbers.checks.is_eligible_for(number, role_name):
+                            rejected.append((messages[category], emoji))
+                            reacted = False
+                        else:
+                            reacted_countries.append((emoji, role_id))
+
+                    if reacted:
+                        target_role_ids.add(role_id)
+                    else:
+                        target_role_ids.discard(role_id)
+
+                # Enforce the country limit (preferring the countries the member already had).
+                if len(reacted_countries) > 2:
+                    reacted_countries.sort(key=lambda country: country[1] not in current_role_ids)
+                    for emoji, role_id in reacted_countries[2:]:
+                        rejected.append((messages[category], emoji))
+                        target_role_ids.discard(role_id)
+
+            if target_role_ids != current_role_ids or rejected:
+                fixes.append((member, target_role_ids, rejected))
+
+        async def apply_fix(fix) -> None:
+            member, target_role_ids, rejected = fix
+            if target_role_ids != {role.id for role in member.roles}:
+                await member.edit(roles=roles_from_ids(guild, target_role_ids))
+            for message, emoji in rejected:
+                await self.remove_user_reaction(message, emoji, member)
+
+        await run_paced(fixes, apply_fix)
+        print(f"REACTIONS: Reconciled the reaction roles of {len(fixes)} members.")
+
+    @Cog.listener()
+    async def on_ready(self) -> None:
+        # Reconcile the reaction roles once (on_ready can fire again after reconnecting).
+        if not self.reconciled:
+            self.reconciled = True
+            await self.reconcile_selections()
 
     @Cog.listener()
     async def on_raw_reaction_add(self, payload):
@@ -243,21 +422,19 @@ class Reactions(Cog):
                 pass
             finally:
                 # Remove their reaction.
-                await message.remove_reaction(emoji, user)
+                await self.remove_user_reaction(message, emoji, user)
             return
 
         # Check that the reaction added is valid.
         if emoji in self.reaction_to_role[category].keys():
-            # Mark an event.
-            self.spam_protection.mark_event(user)
-
-            # Handle checking eligibility and adding the requested role.
-            await self.reaction_role_add(
+            # Queue the role to be added (eligibility is checked when the batch is applied).
+            self.queue_selection(
                 user,
                 self.reaction_to_role[category][emoji],
                 category,
                 message,
                 emoji,
+                added=True,
             )
         else:
             # The reaction added isn't an accepted one, so remove it.
@@ -277,19 +454,28 @@ class Reactions(Cog):
         if not category:
             return
 
-        # Fetch some info from the payload.
+        # Ignore the removals made by the bot itself (such as rejected picks).
         emoji = str(payload.emoji)
+        if (payload.message_id, payload.user_id, emoji) in self.bot_removals:
+            self.bot_removals.discard((payload.message_id, payload.user_id, emoji))
+            return
+
+        # Fetch some info from the payload.
         message = await self.bot.get_channel(payload.channel_id).fetch_message(payload.message_id)
         user = message.guild.get_member(payload.user_id)
+        if user is None:
+            return
 
         # Check that the reaction removed was a valid one.
         if emoji in self.reaction_to_role[category].keys():
-            # Handle removing the reaction role.
-            await self.reaction_role_remove(
+            # Queue the role to be removed.
+            self.queue_selection(
                 user,
                 self.reaction_to_role[category][emoji],
                 category,
                 message,
+                emoji,
+                added=False,
             )
 
 
@@ -22,7 +22,8 @@ from threading import Thread
 from asyncio import run_coroutine_threadsafe
 
 from utils.classes import NumEmbed
-from utils.wrappers import stream_wrapper
+from utils.metrics import metrics
+from utils.wrappers import stream_wrapper, paced_stream
 from utils.helpers import timestamp_to_datetime
 
 
@@ -30,8 +31,9 @@ class Submissions(Cog):
     def __init__(self, bot) -> None:
         self.bot = bot
 
-        # Watches the submissions on the subreddit.
-        self.submissions_thread = Thread(target=self.watch_submissions)
+        # Watches the submissions on the subreddit (its metrics are kept if the stream restarts).
+        metrics.register_stream("submissions")
+        self.submissions_thread = Thread(target=self.watch_submissions, name="submissions-stream")
         self.submissions_thread.start()
 
         print("SUBMISSIONS: Watching submissions.")
@@ -41,7 +43,7 @@ class Submissions(Cog):
         Sends a message to the submissions feed channel.
         :param submission: The submission to send a message for.
         """
-        submissions_feed_channel = self.bot.get_channel(self.bot.settings.discord.ids["feed_channels"]["submissions_feed"])
+        submissions_feed_channel = self.bot.get_channel(self.bot.settings.compiled.feed_channels["submissions_feed"])
 
         submission_embed = NumEmbed(
             title=submission.title,
@@ -67,8 +69,9 @@ class Submissions(Cog):
         """
         Watches for submissions made on the main subreddit and then sends them to the submissions feed.
         """
-        # Start a submissions stream.
-        for submission in self.bot.reddit.main_subreddit.stream.submissions(skip_existing=True):
+        # Start a submissions stream (which yields None after each poll so that a heartbeat can be recorded).
+        for submission in paced_stream(self.bot.reddit.main_subreddit.stream.submissions(skip_existing=True, pause_after=-1), "submissions"):
+
             # Attempt to send a message to the submissions feed.
             run_coroutine_threadsafe(
                 self.send_submissions_feed_message(submission),
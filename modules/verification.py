@@ -17,15 +17,26 @@ from discord.utils import get
 from discord.ext.commands import Cog, command, check, bot_has_permissions
 from discord.ext.commands.errors import MissingRequiredArgument, BotMissingPermissions, BadArgument
 
+from os import path, remove
+from json import loads, dumps
+from re import findall
 from random import randint
+from datetime import datetime, timedelta
+from threading import Thread
+from asyncio import run_coroutine_threadsafe
+
+from praw.models import Message
 
 from textwrap import dedent
 
 from utils.classes import NumEmbed
-from utils.helpers import filter_username
+from utils.metrics import metrics
+from utils.wrappers import stream_wrapper, paced_stream
+from utils.helpers import filter_username, roles_from_ids, get_data_path, run_paced
 from utils.numbers import get_number_nation
+from utils.pending_verification import PendingVerifications
 from utils.errors import AlreadyVerifiedCheckFailure
-from utils.checks import is_in_main_guild, is_verified, is_not_verified
+from utils.checks import is_in_main_guild, is_verified, is_not_verified, is_admin, has_role
 
 
 class VerificationHandler:
@@ -47,16 +58,98 @@ class VerificationHandler:
         role_ids = []
         if number is not None:
             role_ids = [
-                self.bot.settings.discord.role_ids.nations[get_number_nation(number)],
-                self.bot.settings.discord.role_ids.odd_and_even[self.bot.numbers.checks.parity(number)],
+                self.bot.settings.compiled.nation_roles[get_number_nation(number)],
+                self.bot.settings.compiled.parity_roles[self.bot.numbers.checks.parity(number)],
             ]
         else:
             role_ids = [
-                self.bot.settings.discord.role_ids.other["Numberless"],
+                self.bot.settings.compiled.numberless_role,
             ]
-        role_ids.append(self.bot.settings.discord.role_ids.other["Verified"])
+        role_ids.append(self.bot.settings.compiled.verified_role)
         return role_ids
 
+    def classify_number(self, number) -> tuple:
+        """
+        Works out the number specific roles for a number.
+        :param number: The number to classify (or None).
+        :return: A tuple of the initial role ids and the set of country role ids the number is eligible for.
+        """
+        eligible_countries = set()
+        if number is not None:
+            eligible_countries = {
+                role_id for name, role_id in self.bot.settings.compiled.country_roles.items()
+                if self.bot.numbers.checks.is_eligible_for(number, name)
+            }
+        return self.get_initial_roles(number), eligible_countries
+
+    def get_target_roles(self, current_role_ids: set, number, classification: tuple = None) -> set:
+        """
+        Works out the roles a verified member should have for their number (keeping any unrelated roles).
+        :param current_role_ids: The ids of the roles the member currently has.
+        :param number: The member's number (or None).
+        :param classification: Optional. The result of classify_number for the number (if it was already worked out).
+        :return: The set of role ids the member should have.
+        """
+        initial_roles, eligible_countries = classification if classification is not None else self.classify_number(number)
+
+        ineligible_countries = set(self.bot.settings.compiled.country_roles.values()) - eligible_countries
+
+        return (set(current_role_ids) - self.bot.settings.compiled.number_roles - ineligible_countries) | set(initial_roles)
+
+    def get_target_nick(self, current_nick: str, username: str, number) -> str:
+        """
+        Works out the nickname a verified member should have (keeping their custom nickname if it still fits).
+        :param current_nick: The member's current display name.
+        :param username: The member's Reddit username.
+        :param number: The member's number (or None).
+        :return: The nickname the member should have.
+        """
+        nickname = f"{number} | {username}"
+
+        name_info = current_nick.split(" | ")
+        if len(name_info) >= 3:
+            custom_nickname = f"{nickname} | {' | '.join(name_info[2:])}"
+            if len(custom_nickname) <= 32:
+                return custom_nickname
+        return nickname
+
+    def get_member_changes(self, member, username: str, number, classification: tuple = None) -> dict:
+        """
+        Works out the changes needed to a verified member's nickname and roles.
+        :param member: The member to check.
+        :param username: The member's Reddit username.
+        :param number: The member's number (or None).
+        :param classification: Optional. The result of classify_number for the number.
+        :return: The keyword arguments for member.edit (empty if nothing needs changing).
+        """
+        current_role_ids = {role.id for role in member.roles}
+        target_role_ids = self.get_target_roles(current_role_ids, number, classification)
+        target_nick = self.get_target_nick(member.display_name, username, number)
+
+        changes = {}
+        if target_role_ids != current_role_ids:
+            changes["roles"] = roles_from_ids(member.guild, target_role_ids)
+        if target_nick != member.display_name:
+            changes["nick"] = target_nick
+        return changes
+
+    async def sync_member(self, member, username: str, number, classification: tuple = None) -> bool:
+        """
+        Updates a verified member's nickname and roles to match their number using a single edit.
+        :param member: The member to update.
+        :param username: The member's Reddit username.
+        :param number: The member's number (or None).
+        :param classification: Optional. The result of classify_number for the number.
+        :return: Whether anything needed changing.
+        """
+        changes = self.get_member_changes(member, username, number, classification)
+        if not changes:
+            return False
+
+        await member.edit(**changes)
+        self.bot.member_index.set(member.id, username, number)
+        return True
+
     async def assign_roles(self, user, role_ids, guild) -> None:
         for role_id in role_ids:
             try:
@@ -70,11 +163,11 @@ class VerificationHandler:
         for role in user.roles:
             try:
                 roles_to_remove = (
-                    list(self.bot.settings.discord.role_ids.nations.values()) +
-                    list(self.bot.settings.discord.role_ids.countries.values()) +
-                    list(self.bot.settings.discord.role_ids.organizations.values()) +
-                    list(self.bot.settings.discord.role_ids.odd_and_even.values()) +
-                    [self.bot.settings.discord.role_ids.other["Numberless"]]
+                    list(self.bot.settings.compiled.nation_roles.values()) +
+                    list(self.bot.settings.compiled.country_roles.values()) +
+                    list(self.bot.settings.compiled.organization_roles.values()) +
+                    list(self.bot.settings.compiled.parity_roles.values()) +
+                    [self.bot.settings.compiled.numberless_role]
                 )
                 if role.id in roles_to_remove:
                     await user.remove_roles(role)
@@ -86,9 +179,90 @@ class Verification(Cog):
     def __init__(self, bot) -> None:
         self.bot = bot
 
-        self.pending_verification = {}
+        self.pending_verification = PendingVerifications()
+        metrics.register_gauge("tng_queue_depth", lambda: len(self.pending_verification), queue="pending_verifications")
+        self.bot.scheduler.register("expire_pending_verifications", self.expire_pending_verifications, timedelta(minutes=1), persist=False)
         self.verification_handler = VerificationHandler(self.bot)
 
+        self.resync_running = False
+
+        # Watches the bot's Reddit inbox for replies containing verification codes.
+        # Its metrics are registered here so that they are kept if the stream restarts.
+        metrics.register_stream("inbox")
+        self.inbox_thread = Thread(target=self.watch_inbox, name="inbox-stream")
+        self.inbox_thread.start()
+
+        print("VERIFICATION: Watching the Reddit inbox.")
+
+    async def expire_pending_verifications(self, due: datetime) -> None:
+        """
+        Expires pending verifications that have been abandoned.
+        """
+        expired = self.pending_verification.tick()
+        if expired:
+            print(f"VERIFICATION: Expired {len(expired)} pending verifications.")
+
+    @Cog.listener()
+    async def on_ready(self) -> None:
+        # Build the member index from the main guild's nicknames.
+        guild = self.bot.get_guild(self.bot.settings.compiled.main_guild)
+        self.bot.member_index.build(guild.members, self.bot.settings.compiled.verified_role)
+
+    @Cog.listener()
+    async def on_number_change(self, username: str, old_number, number: int) -> None:
+        """
+        Updates a verified member's nickname and roles when their Reddit number is assigned or changed.
+        """
+        member_id = self.bot.member_index.find_member_id(username)
+        if member_id is None:
+            return
+
+        member = self.bot.get_guild(self.bot.settings.compiled.main_guild).get_member(member_id)
+        if member is None:
+            return
+
+        # Use the casing the member verified with.
+        username = self.bot.member_index.get(member_id)[0]
+        if not await self.verification_handler.sync_member(member, username, number):
+            return
+
+        # Send a message to the update log.
+        update_log_channel = self.bot.get_channel(self.bot.settings.compiled.log_channels["update_log"])
+        await update_log_channel.send(
+            "",
+            embed=NumEmbed(
+                title="Automatic Update",
+                colour="success",
+                fields={
+                    "Old Number": old_number,
+                    "New Number": number,
+                    "Username": f"u/{username}",
+                    "Discord User": f"{member}\n{member.mention}\n{member.id}",
+                },
+            ),
+        )
+
+    @Cog.listener()
+    async def on_member_update(self, before, after) -> None:
+        """
+        Keeps the member index up to date when a member's nickname or roles change.
+        """
+        if after.guild.id != self.bot.settings.compiled.main_guild:
+            return
+
+        if before.display_name != after.display_name or before.roles != after.roles:
+            self.bot.member_index.update_from_member(after, self.bot.settings.compiled.verified_role)
+
+    @Cog.listener()
+    async def on_member_remove(self, member) -> None:
+        """
+        Removes members who leave the main guild from the member index.
+        """
+        if member.guild.id != self.bot.settings.compiled.main_guild:
+            return
+
+        self.bot.member_index.remove(member.id)
+
     @check(is_in_main_guild)
     @check(is_not_verified)
     @command()
@@ -110,7 +284,7 @@ class Verification(Cog):
             return
 
         # Make sure that the username is valid.
-        if not self.bot.reddit.is_valid_user(username):
+        if not await self.bot.loop.run_in_executor(None, self.bot.reddit.is_valid_user, username):
             await ctx.send(
                 "",
                 embed=NumEmbed(
@@ -120,33 +294,41 @@ class Verification(Cog):
                     user=ctx.author,
                 ),
             )
+            return
 
         # Generate a random verification code.
-        # Add the user to the pending verification dict.
+        # Add the user to the pending verification store and then queue the Reddit PM.
         verification_code = self.verification_handler.generate_code()
-        self.bot.reddit.redditor(username).message(
+        self.pending_verification.add(ctx.author.id, username, verification_code)
+        queue_position = self.bot.message_queue.send(
+            ("verification", ctx.author.id),
+            username,
             "Discord Verification for r/Num",
             self.bot.settings.templates.verification["reddit_pm"].format(
                 verification_code=verification_code,
                 discord_user_str=str(ctx.author),
                 discord_user_id=ctx.author.id,
             ),
+            on_failure=self.verification_pm_failed,
         )
-        self.pending_verification[ctx.author.id] = {"code": verification_code, "username": username}
 
         # Send a message to the user asking them to check their Reddit inbox.
         await ctx.send(
             ctx.author.mention,
             embed=NumEmbed(
                 title="Verification",
-                description="A code has been sent to your Reddit inbox.\nPlease reply with '$confirm (code)' here.",
+                description="A code will be sent to your Reddit inbox shortly.\nPlease reply to that message with the code (or use '$confirm (code)' here) within 30 minutes.",
                 colour=0X007E80,
+                fields={
+                    "Queue Position": queue_position,
+                    "Estimated Wait": f"{self.bot.message_queue.eta(queue_position)} seconds",
+                },
                 user=ctx.author,
             ),
         )
 
         # Send a message to the (pending) verification log channel.
-        verif_log_channel = self.bot.get_channel(self.bot.settings.discord.ids["log_channels"]["verification_log"])
+        verif_log_channel = self.bot.get_channel(self.bot.settings.compiled.log_channels["verification_log"])
         await verif_log_channel.send(
             "",
             embed=NumEmbed(
@@ -159,6 +341,80 @@ class Verification(Cog):
             ),
         )
 
+    @stream_wrapper
+    def watch_inbox(self) -> None:
+        """
+        Watches the bot's Reddit inbox and confirms verifications from replies containing the verification code.
+        """
+        # Unread replies from while the bot was down are included (confirmed ones are marked read, so they aren't seen twice).
+        for item in paced_stream(self.bot.reddit.inbox.stream(pause_after=-1), "inbox"):
+
+            # Only private messages from (existing) users are relevant.
+            if not isinstance(item, Message) or item.author is None:
+                continue
+
+            # The author is already an authenticated Redditor object, so there is no need to look them up again.
+            confirmed = run_coroutine_threadsafe(
+                self.confirm_from_inbox(item.author.name, item.body),
+                self.bot.loop,
+            ).result()
+            if confirmed:
+                item.mark_read()
+
+    async def confirm_from_inbox(self, username: str, text: str) -> bool:
+        """
+        Confirms a pending verification from a Reddit message (if it contains the right code).
+        :param username: The author of the message (with the exact casing used on Reddit).
+        :param text: The text of the message.
+        :return: Whether a verification was confirmed.
+        """
+        pending = self.pending_verification.get_by_username(username)
+        if pending is None:
+            return False
+        discord_id, verification_info = pending
+
+        if verification_info["code"] not in [int(code) for code in findall(r"\d+", text)]:
+            return False
+
+        member = self.bot.get_guild(self.bot.settings.compiled.main_guild).get_member(discord_id)
+        if member is None or has_role(member, self.bot.settings.compiled.verified_role):
+            self.pending_verification.remove(discord_id)
+            return False
+
+        await self.complete_verification(member, username)
+        return True
+
+    def verification_pm_failed(self, key: tuple) -> None:
+        """
+        Called (from the message queue thread) when a verification PM couldn't be sent.
+        :param key: The message queue key (containing the Discord ID of the user).
+        """
+        run_coroutine_threadsafe(self.cancel_verification(key[1]), self.bot.loop)
+
+    async def cancel_verification(self, discord_id: int) -> None:
+        """
+        Cancels a pending verification after the verification PM failed to send.
+        :param discord_id: The Discord ID of the user.
+        """
+        self.pending_verification.remove(discord_id)
+
+        member = self.bot.get_guild(self.bot.settings.compiled.main_guild).get_member(discord_id)
+        if member is None:
+            return
+
+        try:
+            await member.send(
+                "",
+                embed=NumEmbed(
+                    title="Verification",
+                    description="The verification code couldn't be sent to your Reddit inbox. Please try verifying again later.",
+                    colour="failure",
+                    user=member,
+                ),
+            )
+        except Exception:
+            pass
+
     @verify.error
     async def verify_error(self, ctx, error) -> None:
         """
@@ -204,7 +460,7 @@ class Verification(Cog):
         Input your verification code. (use the verify command first)
         """
         # Ensure that the user is already pending verification.
-        if ctx.author.id not in self.pending_verification.keys():
+        if ctx.author.id not in self.pending_verification:
             await ctx.send(
                 "",
                 embed=NumEmbed(
@@ -217,7 +473,7 @@ class Verification(Cog):
             return
 
         # Check that the input code is correct.
-        verification_info = self.pending_verification[ctx.author.id]
+        verification_info = self.pending_verification.get(ctx.author.id)
         if verification_info["code"] != code:
             await ctx.send(
                 "",
@@ -230,8 +486,9 @@ class Verification(Cog):
             )
             return
 
-        # Ensure that the user is still valid.
-        if not self.bot.reddit.is_valid_user(verification_info["username"]):
+        # Ensure that the user is still valid (and get the exact casing of their username).
+        username = await self.bot.loop.run_in_executor(None, self.bot.reddit.get_username_casing, verification_info["username"])
+        if username is None:
             await ctx.send(
                 "",
                 embed=NumEmbed(
@@ -241,26 +498,36 @@ class Verification(Cog):
                     user=ctx.author,
                 ),
             )
-            del self.pending_verification[ctx.author.id]
+            self.pending_verification.remove(ctx.author.id)
             return
 
-        # Process the verification confirmation.
-        # Try to delete the user's confirm message, then remove their old roles (if any).
+        # Try to delete the user's confirm message, then process the verification confirmation.
         try:
             await ctx.message.delete()
         except Exception:
             pass
         finally:
-            await self.verification_handler.remove_roles(ctx.author)
+            await self.complete_verification(ctx.author, username)
+
+    async def complete_verification(self, member, username: str) -> None:
+        """
+        Completes a verification, setting the member's nickname and initial roles.
+        :param member: The member who has been verified.
+        :param username: The Reddit username they verified (with the exact casing used on Reddit).
+        """
+        self.pending_verification.remove(member.id)
+
+        # Remove the member's old roles (if any).
+        await self.verification_handler.remove_roles(member)
 
         # Get the user's number then set their nickname.
-        username = self.bot.reddit.get_username_casing(verification_info["username"])
-        number = self.bot.numbers.search.user_to_num(verification_info["username"])
-        await ctx.author.edit(nick=f"{number} | {username}")
+        number = self.bot.numbers.search.user_to_num(username)
+        await member.edit(nick=f"{number} | {username}")
+        self.bot.member_index.set(member.id, username, number)
 
         # Get the user's initial roles and then assign them.
         initial_roles = self.verification_handler.get_initial_roles(number)
-        await self.verification_handler.assign_roles(ctx.author, initial_roles, ctx.guild)
+        await self.verification_handler.assign_roles(member, initial_roles, member.guild)
 
         # Attempt to send a message to the user. Then send a message to the confirmation log.
         info_msg = self.bot.settings.templates.verification["verified_pm"]
@@ -284,11 +551,11 @@ class Verification(Cog):
             )
 
         try:
-            await ctx.author.send(info_msg)
+            await member.send(info_msg)
         except Exception:
             pass
         finally:
-            confirm_log_channel = self.bot.get_channel(self.bot.settings.discord.ids["log_channels"]["confirmation_log"])
+            confirm_log_channel = self.bot.get_channel(self.bot.settings.compiled.log_channels["confirmation_log"])
             await confirm_log_channel.send(
                 "",
                 embed=NumEmbed(
@@ -297,7 +564,7 @@ class Verification(Cog):
                     fields={
                         "Number": number,
                         "Reddit": f"u/{username}",
-                        "Discord User": f"{ctx.author}\n{ctx.author.mention}\n{ctx.author.id}",
+                        "Discord User": f"{member}\n{member.mention}\n{member.id}",
                         "Nation": number_nation,
                         "Odd/Even": number_parity,
                     },
@@ -358,9 +625,19 @@ class Verification(Cog):
         """
         Update your number information on Discord (should your number change).
         """
-        current_info = ctx.author.display_name.split(" | ")
-        username = current_info[1]
-        nick_number = int(current_info[0])
+        identity = self.bot.member_index.get(ctx.author.id)
+        if identity is None:
+            await ctx.send(
+                "",
+                embed=NumEmbed(
+                    title="Updating",
+                    description="Your Reddit account could not be found. Please contact the moderators.",
+                    colour="failure",
+                    user=ctx.author,
+                ),
+            )
+            return
+        username, nick_number = identity
 
         # Check that the user is valid on Reddit. If not then remove their verification roles.
         if not self.bot.reddit.is_valid_user(username):
@@ -378,6 +655,7 @@ class Verification(Cog):
                 pass
             finally:
                 await self.verification_handler.remove_roles(ctx.author)
+                self.bot.member_index.remove(ctx.author.id)
             return
 
         # Check to see if the user's number has changed.
@@ -394,13 +672,8 @@ class Verification(Cog):
             )
             return
 
-        # Process the update.
-        await self.verification_handler.remove_roles(ctx.author)
-        await ctx.author.edit(nick=f"{number} | {username}")
-
-        # Get the initial roles and then assign them.
-        initial_roles = self.verification_handler.get_initial_roles(number)
-        await self.verification_handler.assign_roles(ctx.author, initial_roles, ctx.guild)
+        # Process the update (setting the new nickname and roles in one go).
+        await self.verification_handler.sync_member(ctx.author, username, number)
 
         # Send a message to the user.
         await ctx.send(
@@ -413,7 +686,7 @@ class Verification(Cog):
         )
 
         # Send a message to the update log.
-        update_log_channel = self.bot.get_channel(self.bot.settings.discord.ids["log_channels"]["update_log"])
+        update_log_channel = self.bot.get_channel(self.bot.settings.compiled.log_channels["update_log"])
         await update_log_channel.send(
             "",
             embed=NumEmbed(
@@ -428,6 +701,141 @@ class Verification(Cog):
             ),
         )
 
+    @check(is_admin)
+    @check(is_in_main_guild)
+    @command()
+    async def resync(self, ctx, mode: str = "resume") -> None:
+        """
+        (ADMIN) Re-sync the nicknames and roles of all verified members. Use 'restart' to ignore a previous unfinished run.
+        """
+        if self.resync_running:
+            await ctx.send(
+                "",
+                embed=NumEmbed(
+                    title="Re-sync",
+                    description="A re-sync is already running.",
+                    colour="failure",
+                    user=ctx.author,
+                    footer_text="Restricted Cmd",
+                ),
+            )
+            return
+        self.resync_running = True
+
+        try:
+            await self.run_resync(ctx, restart=(mode.lower() == "restart"))
+        finally:
+            self.resync_running = False
+
+    async def run_resync(self, ctx, restart: bool = False) -> None:
+        """
+        Streams through the guild's members (in order of ID) and applies any nickname and role differences.
+        Progress is saved after every batch so that an interrupted re-sync can be resumed.
+        :param ctx: The context of the resync command.
+        :param restart: Whether to ignore the saved progress of a previous run.
+        """
+        progress_path = get_data_path("resync_progress.json")
+        progress = {"last_member_id": 0, "checked": 0, "updated": 0, "failed": 0, "skipped": 0}
+        if not restart:
+            try:
+                with open(progress_path, "r", encoding="utf-8") as progress_file:
+                    progress.update(loads(progress_file.read()))
+            except FileNotFoundError:
+                pass
+
+        # Precompute the number of each user and the classification of each number.
+        user_numbers = {username.lower(): number for number, username in self.bot.numbers.numbers.items()}
+        classifications = {}
+
+        members = sorted(
+            [member for member in ctx.guild.members if member.id > progress["last_member_id"]],
+            key=lambda member: member.id,
+        )
+        total = progress["checked"] + len(members)
+
+        status_message = await ctx.send(
+            "",
+            embed=NumEmbed(
+                title="Re-sync",
+                description=f"{'Resuming' if progress['checked'] else 'Starting'} the re-sync of {total} members.",
+                user=ctx.author,
+                footer_text="Restricted Cmd",
+            ),
+        )
+
+        async def apply_changes(change) -> None:
+            member, username, number, changes = change
+            await member.edit(**changes)
+            self.bot.member_index.set(member.id, username, number)
+            progress["updated"] += 1
+
+        batch_size = 100
+        for i in range(0, len(members), batch_size):
+            batch = members[i:i + batch_size]
+
+            # Work out which members in the batch have differences.
+            changes = []
+            for member in batch:
+                # Members who aren't indexed (such as unverified ones) can't be re-synced.
+                identity = self.bot.member_index.get(member.id)
+                if identity is None:
+                    progress["skipped"] += 1
+                    continue
+
+                username = identity[0]
+                number = user_numbers.get(username.lower())
+                if number not in classifications:
+                    classifications[number] = self.verification_handler.classify_number(number)
+
+                member_changes = self.verification_handler.get_member_changes(member, username, number, classifications[number])
+                if member_changes:
+                    changes.append((member, username, number, member_changes))
+
+            # Only the edits that succeed are counted as updated.
+            updated_before = progress["updated"]
+            await run_paced(changes, apply_changes)
+
+            # Save the progress and then report it.
+            progress["last_member_id"] = batch[-1].id
+            progress["checked"] += len(batch)
+            progress["failed"] += len(changes) - (progress["updated"] - updated_before)
+            with open(progress_path, "w", encoding="utf-8") as progress_file:
+                progress_file.write(dumps(progress))
+
+            await status_message.edit(
+                embed=NumEmbed(
+                    title="Re-sync (In Progress)",
+                    fields={
+                        "Checked": f"{progress['checked']}/{total}",
+                        "Updated": progress["updated"],
+                        "Failed": progress["failed"],
+                        "Skipped (Not Indexed)": progress["skipped"],
+                    },
+                    user=ctx.author,
+                    footer_text="Restricted Cmd",
+                ),
+            )
+
+        # The re-sync has finished, so the progress no longer needs to be kept.
+        if path.exists(progress_path):
+            remove(progress_path)
+
+        await status_message.edit(
+            embed=NumEmbed(
+                title="Re-sync",
+                description="Succesfully re-synced the verified members.",
+                colour="success",
+                fields={
+                    "Checked": progress["checked"],
+                    "Updated": progress["updated"],
+                    "Failed": progress["failed"],
+                    "Skipped (Not Indexed)": progress["skipped"],
+                },
+                user=ctx.author,
+                footer_text="Restricted Cmd",
+            ),
+        )
+
 
 def setup(bot) -> None:
     bot.add_cog(Verification(bot))
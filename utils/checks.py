@@ -13,23 +13,64 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-from discord.utils import find
-
 import utils.errors as errors
 
 
+class RoleCache:
+    """
+    Caches the role IDs of members as sets (so role checks don't search through the member's roles).
+    A member's entry is invalidated whenever Discord sends an update for them (and a guild's entries when its roles change).
+    """
+    def __init__(self) -> None:
+        self.role_ids = {}
+
+    def get(self, member) -> frozenset:
+        """
+        Gets the role IDs of a member.
+        :param member: The member (users outside of a guild have no roles).
+        :return: The IDs of the member's roles.
+        """
+        guild = getattr(member, "guild", None)
+        if guild is None:
+            return frozenset()
+
+        key = (guild.id, member.id)
+        role_ids = self.role_ids.get(key)
+        if role_ids is None:
+            role_ids = self.role_ids[key] = frozenset(role.id for role in member.roles)
+        return role_ids
+
+    def invalidate(self, member) -> None:
+        """
+        Removes a member's cached role IDs.
+        """
+        self.role_ids.pop((member.guild.id, member.id), None)
+
+    def invalidate_guild(self, guild) -> None:
+        """
+        Removes the cached role IDs of every member of a guild (used when its roles change).
+        """
+        for key in [key for key in self.role_ids if key[0] == guild.id]:
+            del self.role_ids[key]
+
+
+role_cache = RoleCache()
+
+
 def has_role(author, role_id) -> bool:
     """
     Checks if a user has a certain role.
     :return: True or False depending on if that user has the role.
     """
-    try:
-        role = find(lambda role: role.id == role_id, author.roles)
-        if role is not None:
-            return True
-    except Exception:
-        pass
-    return False
+    return role_id in role_cache.get(author)
+
+
+def is_staff(user, compiled_settings) -> bool:
+    """
+    Checks if a user is a bot admin or developer.
+    :return: True or False depending on if they are.
+    """
+    return user.id in compiled_settings.admins or user.id in compiled_settings.developers
 
 
 async def is_in_main_guild(ctx):
@@ -37,11 +78,8 @@ async def is_in_main_guild(ctx):
     Checks if a message was sent in the main Num guild.
     :return: True if it is and an error is raised if it isn't.
     """
-    try:
-        if ctx.guild.id == ctx.bot.settings.discord.main_guild:
-            return True
-    except Exception:
-        pass
+    if ctx.guild is not None and ctx.guild.id == ctx.bot.settings.compiled.main_guild:
+        return True
     raise errors.MainGuildCheckFailure
 
 
@@ -50,11 +88,8 @@ async def is_not_in_main_guild(ctx):
     Checks if a message was not sent in the main Num guild.
     :return: True if wasn't or an error is raised if it isn't.
     """
-    try:
-        if ctx.guild.id != ctx.bot.settings.discord.main_guild:
-            return True
-    except Exception:
-        pass
+    if ctx.guild is not None and ctx.guild.id != ctx.bot.settings.compiled.main_guild:
+        return True
     raise errors.NotMainGuildCheckFailure
 
 
@@ -63,21 +98,18 @@ async def is_developer(ctx):
     Checks if the user is a bot developer.
     :return: True or an error is raised (depending on if the user is).
     """
-    if ctx.author.id in ctx.bot.settings.discord.developers:
+    if ctx.author.id in ctx.bot.settings.compiled.developers:
         return True
     raise errors.DeveloperCheckFailure
 
 
 async def is_admin(ctx):
     """
-    Checks if a user is an admin.
+    Checks if a user is an admin (developers are also admins).
     :return: Either True or an error (depending on if the user is).
     """
-    try:
-        if ctx.author.id in ctx.bot.settings.discord.admins or await is_developer(ctx):
-            return True
-    except errors.DeveloperCheckFailure:
-        pass
+    if is_staff(ctx.author, ctx.bot.settings.compiled):
+        return True
     raise errors.AdminCheckFailure
 
 
@@ -86,11 +118,9 @@ async def is_moderator(ctx):
     Checks if a user has the moderator role (or is an admin).
     :return: True if they do, otherwise an error is raised.
     """
-    try:
-        if has_role(ctx.author, ctx.bot.settings.discord.role_ids.other["Moderator"]) or await is_admin(ctx):
-            return True
-    except errors.AdminCheckFailure:
-        pass
+    compiled_settings = ctx.bot.settings.compiled
+    if has_role(ctx.author, compiled_settings.moderator_role) or is_staff(ctx.author, compiled_settings):
+        return True
     raise errors.ModeratorCheckFailure
 
 
@@ -99,7 +129,7 @@ async def is_verified(ctx):
     Checks if a user is verified.
     :return: True or an error is raised depending on if they have the verified role.
     """
-    if has_role(ctx.author, ctx.bot.settings.discord.role_ids.other["Verified"]):
+    if has_role(ctx.author, ctx.bot.settings.compiled.verified_role):
         return True
     raise errors.VerifiedCheckFailure
 
@@ -109,9 +139,6 @@ async def is_not_verified(ctx):
     Checks if a user isn't verified.
     :return: True or an error (depending on the result).
     """
-    try:
-        user_verified = await is_verified(ctx)
-        if user_verified:
-            raise errors.AlreadyVerifiedCheckFailure
-    except errors.VerifiedCheckFailure:
+    if not has_role(ctx.author, ctx.bot.settings.compiled.verified_role):
         return True
+    raise errors.AlreadyVerifiedCheckFailure
@@ -20,10 +20,15 @@ from jsonmerge import merge
 
 from textwrap import dedent
 from num2words import num2words
+from sortedcontainers import SortedList
 
+from os import path, fsync, replace
 from time import sleep
 from typing import Union
-from threading import Thread
+from collections import deque
+from threading import Thread, Lock
+
+from utils.helpers import get_data_path
 
 
 class NumEmbed(Embed):
@@ -91,11 +96,40 @@ class NumEmbed(Embed):
 
 
 class PointsLeaderboard:
-    def __init__(self, reddit) -> None:
+    """
+    The points leaderboard of the nations.
+    Every award is appended to a local ledger (so no points are lost in a crash), and the ledger is
+    periodically compacted into a single snapshot that is also saved to the wiki.
+    Awards are applied straight away and written to the ledger together by write_ledger (in an executor).
+    """
+    def __init__(self, reddit, publisher) -> None:
         self.reddit = reddit
+        self.publisher = publisher
         self.leaderboard = {"Numberless": 0, "000s": 0, "100s": 0, "200s": 0, "300s": 0, "400s": 0, "500s": 0, "600s": 0, "700s": 0, "800s": 0, "900s": 0}
 
-        self.load()
+        # The IDs of the submissions that have already been awarded points.
+        self.awarded = set()
+
+        # The ranking is kept sorted as points change (ties keep the order above), and renders are cached per version.
+        self.ranking = SortedList()
+        self.ordinals = []
+        self.version = 0
+        self.render_cache = {}
+
+        self.ledger_path = get_data_path("points_ledger.jsonl")
+        self.ledger_lock = Lock()
+
+        # The awards that haven't been written to the ledger yet.
+        self.unwritten = deque()
+
+        # Replay the local ledger if there is one, otherwise start one from the wiki page.
+        if path.exists(self.ledger_path):
+            self.replay()
+        else:
+            self.load()
+            self.compact(save=False)
+
+        self.rebuild_ranking()
 
     def load(self) -> None:
         """
@@ -104,11 +138,137 @@ class PointsLeaderboard:
         loaded_leaderboard = loads(self.reddit.main_subreddit.wiki["points_leaderboard"].content_md)
         self.leaderboard = merge(self.leaderboard, loaded_leaderboard)
 
+    def replay(self) -> None:
+        """
+        Rebuilds the leaderboard from the local ledger.
+        """
+        with open(self.ledger_path, "r", encoding="utf-8") as ledger_file:
+            for line in ledger_file:
+                if not line.strip():
+                    continue
+
+                record = loads(line)
+                if "snapshot" in record:
+                    self.leaderboard = merge(self.leaderboard, record["snapshot"])
+                    self.awarded = set(record["awarded"])
+                elif record["submission_id"] not in self.awarded:
+                    # Awards written after a snapshot that already includes them are skipped.
+                    self.leaderboard[record["nation"]] = self.leaderboard.get(record["nation"], 0) + record["delta"]
+                    self.awarded.add(record["submission_id"])
+        print(f"Replayed the points ledger ({len(self.awarded)} awards).")
+
+    def award(self, day: int, submission_id: str, nation: str, delta: int = 1) -> bool:
+        """
+        Awards points to a nation for a submission. Each submission can only be awarded once.
+        The award is queued to be written to the ledger (by write_ledger).
+        :param day: The Num Day the points are for.
+        :param submission_id: The ID of the submission the points are for.
+        :param nation: The nation to award the points to.
+        :param delta: The amount of points.
+        :return: Whether the points were awarded.
+        """
+        if submission_id in self.awarded:
+            return False
+
+        self.set_points(nation, self.leaderboard.get(nation, 0) + delta)
+        self.awarded.add(submission_id)
+        self.unwritten.append({"day": day, "submission_id": submission_id, "nation": nation, "delta": delta})
+        return True
+
+    def write_ledger(self) -> None:
+        """
+        Writes the queued awards to the ledger (with a single fsync). This blocks, so run it in an executor.
+        """
+        records = []
+        while self.unwritten:
+            records.append(self.unwritten.popleft())
+        if not records:
+            return
+
+        with self.ledger_lock:
+            with open(self.ledger_path, "a", encoding="utf-8") as ledger_file:
+                ledger_file.write("".join(dumps(record) + "\n" for record in records))
+                ledger_file.flush()
+                fsync(ledger_file.fileno())
+
+    def rank_entry(self, nation: str) -> tuple:
+        """
+        Gets the entry used to sort a nation in the ranking.
+        """
+        return -self.leaderboard[nation], self.nation_order[nation], nation
+
+    def rebuild_ranking(self) -> None:
+        """
+        Rebuilds the ranking (and the ordinal labels) from the leaderboard.
+        """
+        self.nation_order = {nation: i for i, nation in enumerate(self.leaderboard.keys())}
+        self.ranking = SortedList(self.rank_entry(nation) for nation in self.leaderboard.keys())
+        self.ordinals = [num2words((i + 1), to="ordinal_num") for i in range(len(self.leaderboard))]
+        self.version += 1
+
+    def set_points(self, nation: str, points: int) -> None:
+        """
+        Sets the points of a nation and updates the ranking.
+        :param nation: The nation to set the points of.
+        :param points: The nation's new amount of points.
+        """
+        if nation not in self.leaderboard:
+            self.leaderboard[nation] = points
+            self.rebuild_ranking()
+            return
+
+        self.ranking.remove(self.rank_entry(nation))
+        self.leaderboard[nation] = points
+        self.ranking.add(self.rank_entry(nation))
+        self.version += 1
+
+    def compact(self, save: bool = True) -> None:
+        """
+        Rewrites the ledger as a single snapshot of the leaderboard and then saves it to the wiki.
+        :param save: Whether to save the leaderboard to the wiki.
+        """
+        with self.ledger_lock:
+            with open(self.ledger_path + ".tmp", "w", encoding="utf-8") as ledger_file:
+                ledger_file.write(dumps({"snapshot": self.leaderboard, "awarded": sorted(self.awarded)}) + "\n")
+                ledger_file.flush()
+                fsync(ledger_file.fileno())
+            replace(self.ledger_path + ".tmp", self.ledger_path)
+
+        if save:
+            self.save()
+
     def save(self) -> None:
         """
-        Saves the leaderboard to the wiki page.
+        Saves the leaderboard to the wiki page (if it has changed since it was last saved).
         """
-        self.reddit.main_subreddit.wiki["points_leaderboard"].edit(dumps(self.leaderboard), reason="Updated points leaderboard.")
+        self.publisher.publish_now("wiki:points_leaderboard", dumps(self.leaderboard), self.write)
+
+    def queue_save(self) -> None:
+        """
+        Queues the leaderboard to be saved (merging it with any other saves made in the publish window).
+        """
+        self.publisher.publish("wiki:points_leaderboard", dumps(self.leaderboard), self.write)
+
+    def write(self, content: str) -> None:
+        """
+        Writes the leaderboard to the wiki page.
+        :param content: The serialised leaderboard.
+        """
+        self.reddit.main_subreddit.wiki["points_leaderboard"].edit(content, reason="Updated points leaderboard.")
+
+    def cached_render(self, name: tuple, render):
+        """
+        Gets a render of the leaderboard from the cache (rendering it if this version hasn't been rendered yet).
+        :param name: The name of the render (including any options).
+        :param render: The function that renders it.
+        :return: The render.
+        """
+        cache_key = (*name, self.version)
+        if cache_key not in self.render_cache:
+            # Drop the renders of older versions.
+            self.render_cache = {key: value for key, value in self.render_cache.items() if key[-1] == self.version}
+            self.render_cache[cache_key] = render()
+        return self.render_cache[cache_key]
 
     @property
     def field_representation(self) -> dict:
@@ -116,10 +276,10 @@ class PointsLeaderboard:
         Represents the points leaderboard in a dictionary (used for embeds).
         :return: The represented points leaderboard.
         """
-        fields = {}
-        for i, faction_points in enumerate(sorted(self.leaderboard.items(), key=lambda x: x[1], reverse=True)):
-            fields[num2words((i + 1), to="ordinal_num")] = f"{faction_points[0]} ({faction_points[1]} points)"
-        return fields
+        return dict(self.cached_render(("fields",), lambda: {
+            self.ordinals[i]: f"{nation} ({-negative_points} points)"
+            for i, (negative_points, _, nation) in enumerate(self.ranking)
+        }))
 
     def leaderboard_table(self, header: bool = True) -> str:
         """
@@ -127,6 +287,12 @@ class PointsLeaderboard:
         :param header: Whether the table should have a header.
         :return: The generated markdown table.
         """
+        return self.cached_render(("table", header), lambda: self.render_table(header))
+
+    def render_table(self, header: bool) -> str:
+        """
+        Renders the leaderboard table (use leaderboard_table to get the cached version).
+        """
         table_text = ""
         if header is True:
             table_text = dedent("""
@@ -135,11 +301,11 @@ class PointsLeaderboard:
             """).strip()
 
         table_row_template = "|{place}|{nation}|{points}|"
-        for i, nation_points in enumerate(sorted(self.leaderboard.items(), key=lambda x: x[1], reverse=True)):
+        for i, (negative_points, _, nation) in enumerate(self.ranking):
             table_text += "\n" + table_row_template.format(
-                place=num2words((i + 1), to="ordinal_num"),
-                nation=nation_points[0],
-                points=nation_points[1],
+                place=self.ordinals[i],
+                nation=nation,
+                points=-negative_points,
             )
 
         return table_text.strip()
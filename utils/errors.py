@@ -63,3 +63,10 @@ class NotMainGuildCheckFailure(CheckFailure):
     Raised when a not main guild check fails.
     """
     pass
+
+
+class InvalidSettingsError(Exception):
+    """
+    Raised when the settings are missing a required value (or a value has the wrong type).
+    """
+    pass
@@ -0,0 +1,82 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from io import BytesIO, StringIO, TextIOWrapper
+from csv import writer
+from gzip import GzipFile
+from json import dumps
+
+
+def text_lines(items, title: str):
+    """
+    Generates the lines of a plain text number list.
+    """
+    yield title + "\n"
+    for number, username in items:
+        yield f"#{number} (u/{username})\n"
+
+
+def csv_lines(items, title: str):
+    """
+    Generates the lines of a CSV number list.
+    """
+    row_buffer = StringIO()
+    row_writer = writer(row_buffer)
+
+    def flush() -> str:
+        line = row_buffer.getvalue()
+        row_buffer.seek(0)
+        row_buffer.truncate()
+        return line
+
+    row_writer.writerow(["number", "username"])
+    yield flush()
+    for number, username in items:
+        row_writer.writerow([number, username])
+        yield flush()
+
+
+def json_lines(items, title: str):
+    """
+    Generates the lines of a JSON Lines number list.
+    """
+    for number, username in items:
+        yield dumps({"number": number, "username": username}) + "\n"
+
+
+# The export formats (their file extensions to their line generators).
+EXPORT_FORMATS = {
+    "txt": text_lines,
+    "csv": csv_lines,
+    "jsonl": json_lines,
+}
+
+
+def export_numbers(items, export_format: str, title: str) -> BytesIO:
+    """
+    Writes a number list into a gzip compressed in-memory file (line by line).
+    :param items: The number and username pairs to export.
+    :param export_format: The format to export them in (one of EXPORT_FORMATS).
+    :param title: The title of the list (used by the formats that have one).
+    :return: The compressed file (at its start).
+    """
+    buffer = BytesIO()
+    with GzipFile(fileobj=buffer, mode="wb") as compressed_file:
+        with TextIOWrapper(compressed_file, encoding="utf-8", newline="") as text_file:
+            for line in EXPORT_FORMATS[export_format](items, title):
+                text_file.write(line)
+
+    buffer.seek(0)
+    return buffer
@@ -13,7 +13,11 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from discord import HTTPException
+
+from os import makedirs, path
 from pytz import utc
+from asyncio import Queue, sleep, gather
 from datetime import datetime, timedelta, date
 
 from requests import post
@@ -27,12 +31,12 @@ def get_time() -> datetime:
     return datetime.now(utc)
 
 
-def get_date() -> str:
+def get_date(time: datetime = None) -> str:
     """
-    Gets the current date in a certain format.
+    Gets the current (or a given) date in a certain format.
     :return: The date (in UTC) formatted as day/month/year (in a string).
     """
-    return get_time().strftime("%d/%m/%Y")
+    return (time or get_time()).strftime("%d/%m/%Y")
 
 
 def get_date_time() -> str:
@@ -43,12 +47,21 @@ def get_date_time() -> str:
     return get_time().strftime('%d/%m/%Y at %H:%M:%S')
 
 
-def get_num_day() -> int:
+def get_num_day(time: datetime = None) -> int:
     """
-    Gets the current Num day.
+    Gets the current (or a given time's) Num day.
     :return: The number of days since the 14th January 2020.
     """
-    return int(((get_time() + timedelta(minutes=1)).date() - date(2020, 1, 14)).days)
+    return int((((time or get_time()) + timedelta(minutes=1)).date() - date(2020, 1, 14)).days)
+
+
+def get_data_path(filename: str) -> str:
+    """
+    Gets the path of a file in the local data folder (creating the folder if needed).
+    :return: The path to the file.
+    """
+    makedirs("data", exist_ok=True)
+    return path.join("data", filename)
 
 
 def filter_username(username) -> str:
@@ -69,11 +82,55 @@ def timestamp_to_datetime(timestamp: int) -> datetime:
 def upload_text(text: str):
     """
     Uploads some text to hastebin and then returns a link to it.
+    Note that this blocks, so it should be run in an executor.
     """
-    response = post("https://hastebin.com/documents", data=text.encode("utf-8"))
+    try:
+        response = post("https://hastebin.com/documents", data=text.encode("utf-8"), timeout=10)
+    except Exception:
+        return None
     if str(response.status_code)[0] == "2":
         try:
             return f"https://hastebin.com/{response.json()['key']}"
         except Exception:
             pass
     return None
+
+
+def roles_from_ids(guild, role_ids) -> list:
+    """
+    Gets the roles (of a guild) for a set of role ids. The default role is never included.
+    :return: The list of roles (for use when editing a member's roles).
+    """
+    return [role for role in guild.roles if role.id in role_ids and not role.is_default()]
+
+
+async def run_paced(items, func, concurrency: int = 4, delay: float = 1.0) -> None:
+    """
+    Runs a coroutine function on each item with bounded concurrency, pausing between calls to stay under rate limits.
+    If a call is rate limited it is retried once after the time Discord asks for.
+    :param items: The items to process.
+    :param func: The coroutine function to call with each item.
+    :param concurrency: The maximum amount of calls running at once.
+    :param delay: How long each worker waits between calls (in seconds).
+    """
+    queue = Queue()
+    for item in items:
+        queue.put_nowait(item)
+
+    async def worker():
+        while not queue.empty():
+            item = queue.get_nowait()
+            for attempt in range(2):
+                try:
+                    await func(item)
+                except HTTPException as e:
+                    if e.status == 429 and attempt == 0:
+                        await sleep(float(e.response.headers.get("Retry-After", delay * 5)))
+                        continue
+                    print(f"PACED RUNNER: Error processing {item} - {e}")
+                except Exception as e:
+                    print(f"PACED RUNNER: Error processing {item} - {e}")
+                break
+            await sleep(delay)
+
+    await gather(*[worker() for _ in range(concurrency)])
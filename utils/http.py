@@ -0,0 +1,108 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from utils.metrics import metrics
+
+
+class LRUCache:
+    """
+    A bounded cache that drops the least recently used entries once it is full.
+    """
+    def __init__(self, max_size: int = 256) -> None:
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        Gets an entry from the cache (marking it as recently used).
+        :return: The entry (or the default if it isn't cached).
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def set(self, key, value) -> None:
+        """
+        Adds an entry to the cache (dropping the least recently used entry if it is full).
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The fraction of lookups that were cached.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class HTTPClient:
+    """
+    A shared HTTP session (with connection pooling and timeouts) used for calls to external web services.
+    The session is created on first use, as it has to be created inside the event loop.
+    """
+    def __init__(self, total_timeout: float = 3.0, connect_timeout: float = 1.5, connection_limit: int = 10) -> None:
+        self.timeout = ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.connection_limit = connection_limit
+        self.session = None
+
+    def get_session(self) -> ClientSession:
+        """
+        Gets the shared session (creating it if needed).
+        """
+        if self.session is None or self.session.closed:
+            self.session = ClientSession(
+                connector=TCPConnector(limit=self.connection_limit, ttl_dns_cache=300),
+                timeout=self.timeout,
+            )
+        return self.session
+
+    async def get_json(self, url: str, **kwargs):
+        """
+        Gets a JSON response.
+        :param url: The URL to get.
+        :return: The decoded JSON.
+        :raises aiohttp.ClientError: If the request fails.
+        :raises asyncio.TimeoutError: If the request takes too long.
+        """
+        with metrics.timer("http", urlsplit(url).netloc):
+            async with self.get_session().get(url, **kwargs) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+    async def close(self) -> None:
+        """
+        Closes the shared session.
+        """
+        if self.session is not None:
+            await self.session.close()
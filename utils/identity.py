@@ -0,0 +1,164 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from json import loads, dumps
+
+from discord import Member
+
+from utils.helpers import get_data_path
+
+
+class MemberIndex:
+    """
+    A two-way index between Discord members and their (verified) Reddit username and number.
+    It is built from member nicknames and saved locally, so lookups don't need to parse nicknames.
+    """
+    def __init__(self) -> None:
+        self.path = get_data_path("member_index.json")
+
+        # Discord ID to (Reddit username, number) and lowercase Reddit username to Discord ID.
+        self.by_discord = {}
+        self.by_reddit = {}
+
+        # Whether the index has been built from the guild members yet.
+        self.built = False
+
+        self.load()
+
+    def load(self) -> None:
+        """
+        Loads the index from the local file (if it exists).
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as index_file:
+                for discord_id, (username, number) in loads(index_file.read()).items():
+                    self.set(int(discord_id), username, number, save=False)
+        except FileNotFoundError:
+            pass
+        print(f"Loaded {len(self.by_discord)} indexed members.")
+
+    def save(self) -> None:
+        """
+        Saves the index to the local file.
+        """
+        with open(self.path, "w", encoding="utf-8") as index_file:
+            index_file.write(dumps(self.by_discord))
+
+    def set(self, discord_id: int, username: str, number: int = None, save: bool = True) -> None:
+        """
+        Adds or updates a member in the index.
+        :param discord_id: The member's Discord ID.
+        :param username: The member's Reddit username.
+        :param number: The member's number (or None if they don't have one).
+        :param save: Whether to save the index afterwards.
+        """
+        if self.by_discord.get(discord_id) == (username, number):
+            return
+
+        self.remove(discord_id, save=False)
+        self.by_discord[discord_id] = (username, number)
+        self.by_reddit[username.lower()] = discord_id
+
+        if save:
+            self.save()
+
+    def remove(self, discord_id: int, save: bool = True) -> None:
+        """
+        Removes a member from the index.
+        :param discord_id: The member's Discord ID.
+        :param save: Whether to save the index afterwards.
+        """
+        if discord_id not in self.by_discord:
+            return
+
+        username, _ = self.by_discord.pop(discord_id)
+        if self.by_reddit.get(username.lower()) == discord_id:
+            del self.by_reddit[username.lower()]
+
+        if save:
+            self.save()
+
+    def get(self, discord_id: int) -> tuple:
+        """
+        Gets the Reddit username and number of a member.
+        :param discord_id: The member's Discord ID.
+        :return: A tuple of (username, number) or None if they aren't indexed.
+        """
+        return self.by_discord.get(discord_id)
+
+    def find_member_id(self, username: str) -> int:
+        """
+        Gets the Discord ID of a Reddit user.
+        :param username: The Reddit username to look up.
+        :return: Their Discord ID (or None if they aren't indexed).
+        """
+        return self.by_reddit.get(username.lower())
+
+    def update_from_member(self, member: Member, verified_role_id: int, save: bool = True) -> None:
+        """
+        Updates the index entry of a member using their nickname.
+        Nicknames that can't be parsed (such as ones changed by hand) leave the existing entry alone.
+        :param member: The member to update.
+        :param verified_role_id: The ID of the verified role.
+        :param save: Whether to save the index afterwards.
+        """
+        if verified_role_id not in [role.id for role in member.roles]:
+            self.remove(member.id, save=save)
+            return
+
+        identity = parse_nickname(member.display_name)
+        if identity is not None:
+            self.set(member.id, *identity, save=save)
+
+    def build(self, members: list, verified_role_id: int, force: bool = False) -> None:
+        """
+        Builds the index from the members of the main guild (if it hasn't been already).
+        Members who have left since the index was saved are removed from it.
+        :param members: The guild's members.
+        :param verified_role_id: The ID of the verified role.
+        :param force: Whether to rebuild the index even if it has already been built.
+        """
+        if self.built and not force:
+            return
+        self.built = True
+
+        member_ids = set()
+        for member in members:
+            member_ids.add(member.id)
+            self.update_from_member(member, verified_role_id, save=False)
+
+        for discord_id in [discord_id for discord_id in self.by_discord if discord_id not in member_ids]:
+            self.remove(discord_id, save=False)
+        self.save()
+        print(f"Indexed {len(self.by_discord)} verified members.")
+
+
+def parse_nickname(nickname: str) -> tuple:
+    """
+    Parses a verified nickname (in the format 'number | username' with an optional ' | nickname').
+    :param nickname: The nickname to parse.
+    :return: A tuple of (username, number) or None if it isn't in the verified format.
+    """
+    name_info = nickname.split(" | ")
+    if len(name_info) < 2 or not name_info[1]:
+        return None
+
+    if name_info[0] == "None":
+        return name_info[1], None
+
+    try:
+        return name_info[1], int(name_info[0])
+    except ValueError:
+        return None
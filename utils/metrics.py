@@ -0,0 +1,236 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from time import perf_counter, monotonic, time
+from bisect import bisect_left
+from threading import Lock
+from functools import wraps
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+
+# The upper bounds of the histogram buckets (in seconds). These double every two buckets from 1ms to about a minute.
+BUCKET_BOUNDS = [0.001 * 2 ** (i / 2) for i in range(33)]
+
+# The path segments that are followed by an ID or a name (which are replaced so that paths can be grouped).
+PATH_ID_PREFIXES = {"r", "u", "user", "comments", "by_id", "message"}
+
+
+class LatencyHistogram:
+    """
+    A histogram of how long something took (along with its count and error count).
+    """
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        """
+        Records a timing.
+        :param seconds: How long it took.
+        :param error: Whether it failed.
+        """
+        self.buckets[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if error:
+            self.errors += 1
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Estimates a percentile from the buckets.
+        :param fraction: The percentile (as a fraction, e.g 0.95).
+        :return: The estimated percentile (interpolated within its bucket, in seconds).
+        """
+        if self.count == 0:
+            return 0.0
+
+        target = fraction * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.buckets):
+            if bucket_count and seen + bucket_count >= target:
+                if i == len(BUCKET_BOUNDS):
+                    return self.max
+                lower = BUCKET_BOUNDS[i - 1] if i > 0 else 0.0
+                position = (target - seen) / bucket_count
+                return min(lower + (BUCKET_BOUNDS[i] - lower) * position, self.max)
+            seen += bucket_count
+        return self.max
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.count if self.count else 0.0
+
+
+class Metrics:
+    """
+    Records latency histograms in memory, grouped by kind (such as command or reddit) and name.
+    This is thread safe, as Reddit calls are timed in the executor and stream threads.
+    """
+    def __init__(self) -> None:
+        self.histograms = {}
+        self.lock = Lock()
+
+        # The Reddit streams (by name) with their item counts, lag and last heartbeat.
+        self.streams = {}
+
+        # Functions that are called to get the current value of a gauge (a list of the name, labels and function).
+        self.gauges = []
+
+        # The caches whose hit rates are reported (by name).
+        self.caches = {}
+
+    def register_stream(self, name: str) -> None:
+        """
+        Starts tracking a Reddit stream.
+        """
+        self.streams[name] = {"items": 0, "lag": 0.0, "last_heartbeat": monotonic()}
+
+    def stream_heartbeat(self, name: str) -> None:
+        """
+        Records that a stream is still polling (even if it had no new items).
+        """
+        self.streams[name]["last_heartbeat"] = monotonic()
+
+    def stream_item(self, name: str, created_utc: float) -> None:
+        """
+        Records that a stream processed an item.
+        :param name: The name of the stream.
+        :param created_utc: When the item was created (used to work out how far behind the stream is).
+        """
+        stream = self.streams[name]
+        stream["items"] += 1
+        stream["lag"] = max(0.0, time() - created_utc)
+        stream["last_heartbeat"] = monotonic()
+
+    def stalled_streams(self, threshold: float) -> list:
+        """
+        Gets the streams that haven't had a heartbeat recently.
+        :param threshold: How long a stream can go without a heartbeat (in seconds).
+        :return: The names of the stalled streams.
+        """
+        now = monotonic()
+        return [name for name, stream in self.streams.items() if now - stream["last_heartbeat"] > threshold]
+
+    def register_gauge(self, name: str, func, **labels) -> None:
+        """
+        Registers a gauge that is read whenever the metrics are exported.
+        :param name: The name of the gauge.
+        :param func: The function that returns the gauge's current value.
+        :param labels: The labels of the gauge.
+        """
+        self.gauges.append((name, labels, func))
+
+    def register_cache(self, name: str, cache) -> None:
+        """
+        Registers a cache (with hits and misses counters) so its hit rate is exported.
+        """
+        self.caches[name] = cache
+
+    def observe(self, kind: str, name: str, seconds: float, error: bool = False) -> None:
+        """
+        Records a timing.
+        :param kind: The kind of thing that was timed (e.g command, reddit, discord or http).
+        :param name: The name of what was timed (e.g the command or the request path).
+        :param seconds: How long it took.
+        :param error: Whether it failed.
+        """
+        with self.lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = self.histograms[(kind, name)] = LatencyHistogram()
+            histogram.observe(seconds, error)
+
+    @contextmanager
+    def timer(self, kind: str, name: str):
+        """
+        Times the code inside the with block (recording it as an error if an exception is raised).
+        """
+        started = perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(kind, name, perf_counter() - started, error)
+
+    def by_kind(self, kind: str) -> dict:
+        """
+        Gets the histograms of a certain kind.
+        :return: The names to their histograms.
+        """
+        with self.lock:
+            return {name: histogram for (histogram_kind, name), histogram in self.histograms.items() if histogram_kind == kind}
+
+    @property
+    def kinds(self) -> list:
+        with self.lock:
+            return sorted({kind for kind, _ in self.histograms.keys()})
+
+    def instrument_reddit(self, reddit) -> None:
+        """
+        Times every request PRAW makes (by wrapping its requestor).
+        :param reddit: The Reddit instance.
+        """
+        requestor = reddit._core._requestor
+        original_request = requestor.request
+
+        @wraps(original_request)
+        def timed_request(method, url, *args, **kwargs):
+            with self.timer("reddit", f"{method} {normalise_path(url)}"):
+                return original_request(method, url, *args, **kwargs)
+
+        requestor.request = timed_request
+
+    def instrument_discord(self, http_client) -> None:
+        """
+        Times every request made to the Discord REST API (by wrapping discord.py's HTTP client).
+        :param http_client: The bot's HTTP client (bot.http).
+        """
+        original_request = http_client.request
+
+        @wraps(original_request)
+        async def timed_request(route, **kwargs):
+            started = perf_counter()
+            error = False
+            try:
+                return await original_request(route, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                self.observe("discord", f"{route.method} {route.path}", perf_counter() - started, error)
+
+        http_client.request = timed_request
+
+
+def normalise_path(url: str) -> str:
+    """
+    Gets the path of a URL with the IDs and names replaced (so that requests to the same endpoint are grouped).
+    """
+    segments = urlsplit(url).path.strip("/").split("/")
+    for i in range(1, len(segments)):
+        if segments[i - 1] in PATH_ID_PREFIXES:
+            segments[i] = "{}"
+    return "/" + "/".join(segments)
+
+
+metrics = Metrics()
@@ -0,0 +1,169 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from aiohttp import web
+
+from time import time, monotonic
+from psutil import Process
+
+from utils.metrics import metrics, BUCKET_BOUNDS
+
+
+def format_labels(labels: dict) -> str:
+    """
+    Formats the labels of a metric sample.
+    """
+    if not labels:
+        return ""
+    escaped = {key: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for key, value in labels.items()}
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
+
+
+class MetricsText:
+    """
+    Builds a metrics page in the Prometheus text format.
+    """
+    def __init__(self) -> None:
+        self.lines = []
+        self.described = set()
+
+    def add(self, name: str, value, metric_type: str = "gauge", help_text: str = "", **labels) -> None:
+        """
+        Adds a sample (with the metric's type and help text if it is the first sample of that metric).
+        """
+        family = name
+        for suffix in ("_bucket", "_sum", "_count"):
+            if metric_type == "histogram" and name.endswith(suffix):
+                family = name[:-len(suffix)]
+
+        if family not in self.described:
+            self.described.add(family)
+            if help_text:
+                self.lines.append(f"# HELP {family} {help_text}")
+            self.lines.append(f"# TYPE {family} {metric_type}")
+
+        self.lines.append(f"{name}{format_labels(labels)} {float(value):g}" if value is not None else f"{name}{format_labels(labels)} NaN")
+
+    def __str__(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+class MetricsServer:
+    """
+    An optional HTTP server (run on the bot's event loop) that exposes the bot's metrics and health.
+    * /metrics - The metrics in the Prometheus text format.
+    * /healthz - Fails (503) if a Reddit stream has stalled.
+    """
+    def __init__(self, bot, port: int, host: str = "127.0.0.1", stall_threshold: float = 300) -> None:
+        self.bot = bot
+        self.port = port
+        self.host = host
+        self.stall_threshold = stall_threshold
+        self.runner = None
+
+        self.process = Process()
+
+        self.app = web.Application()
+        self.app.router.add_get("/metrics", self.handle_metrics)
+        self.app.router.add_get("/healthz", self.handle_health)
+
+    async def start(self) -> None:
+        """
+        Starts serving (if it hasn't already started).
+        """
+        if self.runner is not None:
+            return
+
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host=self.host, port=self.port).start()
+        print(f"METRICS: Serving metrics on {self.host}:{self.port}.")
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def handle_health(self, request) -> web.Response:
+        stalled = metrics.stalled_streams(self.stall_threshold)
+        if stalled:
+            return web.Response(status=503, text=f"Stalled streams: {', '.join(stalled)}\n")
+        return web.Response(text="OK\n")
+
+    async def handle_metrics(self, request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+    def render(self) -> str:
+        """
+        Renders all of the metrics.
+        """
+        text = MetricsText()
+        now = monotonic()
+
+        # Streams
+        for name, stream in list(metrics.streams.items()):
+            text.add("tng_stream_items_total", stream["items"], "counter", "Items processed by a Reddit stream.", stream=name)
+            text.add("tng_stream_lag_seconds", stream["lag"], help_text="How old the latest item of a stream was when it was processed.", stream=name)
+            text.add("tng_stream_heartbeat_age_seconds", now - stream["last_heartbeat"], help_text="Time since a stream last polled Reddit.", stream=name)
+
+        # Registered gauges (such as queue depths).
+        for name, labels, func in metrics.gauges:
+            try:
+                value = func()
+            except Exception:
+                value = None
+            text.add(name, value, **labels)
+
+        # Event loop lag.
+        loop_monitor = self.bot.loop_monitor
+        text.add("tng_event_loop_lag_seconds", loop_monitor.current_lag, help_text="The current event loop lag.")
+        text.add("tng_event_loop_lag_max_seconds", loop_monitor.max_lag, help_text="The worst event loop lag seen.")
+        text.add("tng_event_loop_stalls", len(loop_monitor.stalls), help_text="Recent event loop stalls.")
+
+        # Latency histograms (copied under the lock, as they are updated from other threads).
+        with metrics.lock:
+            histograms = [
+                (kind, name, list(histogram.buckets), histogram.count, histogram.total, histogram.errors)
+                for (kind, name), histogram in metrics.histograms.items()
+            ]
+        for kind, name, buckets, count, total, errors in histograms:
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKET_BOUNDS, buckets):
+                cumulative += bucket_count
+                text.add("tng_latency_seconds_bucket", cumulative, "histogram", "Latency of commands and upstream calls.", kind=kind, name=name, le=f"{bound:.6g}")
+            text.add("tng_latency_seconds_bucket", count, "histogram", kind=kind, name=name, le="+Inf")
+            text.add("tng_latency_seconds_sum", total, "histogram", kind=kind, name=name)
+            text.add("tng_latency_seconds_count", count, "histogram", kind=kind, name=name)
+        for kind, name, _, _, _, errors in histograms:
+            text.add("tng_errors_total", errors, "counter", "Failed commands and upstream calls.", kind=kind, name=name)
+
+        # Caches
+        for name, cache in metrics.caches.items():
+            text.add("tng_cache_hits_total", cache.hits, "counter", "Cache hits.", cache=name)
+            text.add("tng_cache_misses_total", cache.misses, "counter", "Cache misses.", cache=name)
+            text.add("tng_cache_hit_ratio", cache.hit_rate, help_text="The fraction of cache lookups that hit.", cache=name)
+
+        # Reddit rate limit headroom (these are unknown until the first request has been made).
+        limits = self.bot.reddit.auth.limits
+        text.add("tng_reddit_ratelimit_remaining", limits.get("remaining"), help_text="Reddit requests left in the current window.")
+        text.add("tng_reddit_ratelimit_used", limits.get("used"), help_text="Reddit requests used in the current window.")
+        reset_timestamp = limits.get("reset_timestamp")
+        text.add("tng_reddit_ratelimit_reset_seconds", reset_timestamp - time() if reset_timestamp else None, help_text="Time until the Reddit rate limit window resets.")
+
+        # Memory
+        memory_info = self.process.memory_info()
+        text.add("tng_memory_rss_bytes", memory_info.rss, help_text="Resident memory of the bot.")
+        text.add("tng_memory_vms_bytes", memory_info.vms, help_text="Virtual memory of the bot.")
+
+        return str(text)
@@ -0,0 +1,151 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from sys import _current_frames
+from os import path
+from time import monotonic, sleep as thread_sleep
+from asyncio import sleep, get_event_loop
+from datetime import datetime
+from threading import Thread, get_ident
+from traceback import extract_stack
+from collections import deque
+
+from utils.sentry import get_sentry
+
+
+# The root folder of the bot (used to find the bot's own frames in a stack).
+PROJECT_ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+class LoopMonitor:
+    """
+    Measures how long the event loop is blocked for.
+    A heartbeat task runs on the loop and a watchdog thread checks on it. If the heartbeat is late by more
+    than the threshold, the watchdog captures the loop thread's stack to find the call that is blocking it.
+    """
+    def __init__(self, interval: float = 0.25, threshold: float = 0.5) -> None:
+        self.interval = interval
+        self.threshold = threshold
+
+        self.loop_thread_id = None
+        self.last_beat = monotonic()
+        self.started = False
+
+        # The recent lag samples (in seconds) and the worst lag seen.
+        self.lag_samples = deque(maxlen=240)
+        self.max_lag = 0.0
+
+        # The recent stalls (the stall currently being watched is kept separately until it ends).
+        self.stalls = deque(maxlen=20)
+        self.current_stall = None
+
+    def start(self) -> None:
+        """
+        Starts the heartbeat and the watchdog. This has to be called from the event loop.
+        """
+        if self.started:
+            return
+        self.started = True
+
+        self.loop_thread_id = get_ident()
+        self.last_beat = monotonic()
+        get_event_loop().create_task(self.heartbeat())
+        Thread(target=self.watchdog, name="loop-watchdog", daemon=True).start()
+
+    async def heartbeat(self) -> None:
+        """
+        Regularly records how late the loop is in waking this task up.
+        """
+        while True:
+            started = monotonic()
+            await sleep(self.interval)
+            self.last_beat = monotonic()
+
+            lag = max(0.0, self.last_beat - started - self.interval)
+            self.lag_samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+            # The loop has recovered from a stall, so record how long it lasted.
+            stall = self.current_stall
+            if stall is not None:
+                self.current_stall = None
+                stall["duration"] = lag
+                self.stalls.append(stall)
+                print(f"LOOP MONITOR: The event loop was blocked for {lag:.2f}s at {stall['call_site']}.")
+
+    def watchdog(self) -> None:
+        """
+        Watches the heartbeat (in its own thread) and captures the loop's stack when it is late.
+        """
+        while True:
+            late_by = monotonic() - self.last_beat - self.interval
+            if late_by > self.threshold and self.current_stall is None:
+                self.capture_stall(late_by)
+            thread_sleep(self.interval / 2)
+
+    def capture_stall(self, late_by: float) -> None:
+        """
+        Captures the stack of the loop thread while it is blocked.
+        :param late_by: How late the heartbeat was when the stall was noticed.
+        """
+        frame = _current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return
+
+        stack = extract_stack(frame)
+        self.current_stall = {
+            "time": datetime.utcnow(),
+            "detected_after": late_by,
+            "duration": None,
+            "call_site": self.find_call_site(stack),
+            "stack": "".join(stack.format()[-15:]),
+        }
+
+        sentry = get_sentry()
+        if sentry:
+            sentry.add_breadcrumb(
+                category="event_loop",
+                message=f"Event loop blocked for over {late_by:.2f}s at {self.current_stall['call_site']}",
+                level="warning",
+            )
+
+    @staticmethod
+    def find_call_site(stack) -> str:
+        """
+        Finds the innermost frame of the bot's own code in a stack (the call that is blocking the loop).
+        :return: The call site (file, line and function).
+        """
+        for frame in reversed(stack):
+            filename = path.abspath(frame.filename)
+            if filename.startswith(PROJECT_ROOT) and "site-packages" not in filename and filename != path.abspath(__file__):
+                return f"{path.relpath(filename, PROJECT_ROOT)}:{frame.lineno} in {frame.name}"
+        if stack:
+            return f"{stack[-1].filename}:{stack[-1].lineno} in {stack[-1].name}"
+        return "Unknown"
+
+    @property
+    def current_lag(self) -> float:
+        """
+        The most recent lag sample (or how late the heartbeat currently is, if that is longer).
+        """
+        latest = self.lag_samples[-1] if self.lag_samples else 0.0
+        return max(latest, monotonic() - self.last_beat - self.interval)
+
+    @property
+    def average_lag(self) -> float:
+        """
+        The average of the recent lag samples.
+        """
+        return sum(self.lag_samples) / len(self.lag_samples) if self.lag_samples else 0.0
@@ -21,6 +21,7 @@ from praw.models import Redditor
 from datetime import datetime
 
 from typing import Union
+from threading import Lock
 
 from random import randint, choice
 from sortedcontainers import SortedDict
@@ -30,6 +31,9 @@ from sympy.ntheory import isprime, primefactors
 from utils.reddit import get_reddit
 from utils.settings import get_settings
 
+# The largest number that local facts factorise.
+LOCAL_FACT_FACTORISE_LIMIT = 10 ** 12
+
 
 class Numbers:
     def __init__(self, reddit, settings) -> None:
@@ -43,12 +47,19 @@ class Numbers:
         # This is also using an automatically sorted dictionary for efficiency.
         self.numbers = SortedDict({})
 
+        # Held while the numbers are changed or copied (numbers are assigned from the stream threads).
+        self.lock = Lock()
+
+        # Increased every time a number is assigned (used to tell if anything derived from the numbers is out of date).
+        self.version = 0
+
         # Load the numbers from Reddit.
         self.load_numbers()
 
-        # Handle the current max number.
+        # Handle the current max number (and recalculate it if its settings change).
         self.current_max_number = 0
         self.set_max_number()
+        self.settings.subscribe([("assignment", "numbers")], lambda changed: self.set_max_number())
 
         # Load the subclasses.
         self.search = self.search(self)
@@ -57,6 +68,25 @@ class Numbers:
 
         self.checks = NumberChecks()
 
+        # Callbacks that are called (with the username, old number and new number) when a number is assigned.
+        self.subscribers = []
+
+    def subscribe(self, callback) -> None:
+        """
+        Subscribes a callback to number assignments.
+        Note that callbacks may be called from the stream threads.
+        :param callback: The function to call with the username, old number and new number.
+        """
+        self.subscribers.append(callback)
+
+    def snapshot(self) -> list:
+        """
+        Takes a copy of the assigned numbers (so they can be used while numbers are being assigned).
+        :return: The number and username pairs (in order).
+        """
+        with self.lock:
+            return list(self.numbers.items())
+
     def load_numbers(self) -> None:
         """
         Loads the numbers from Reddit.
@@ -143,7 +173,8 @@ class Numbers:
             # Remove a previous number (if the user had one)
             old_number = self.parent.search.user_to_num(username)
             if old_number is not None:
-                del self.parent.numbers[old_number]
+                with self.parent.lock:
+                    del self.parent.numbers[old_number]
 
             # Assign the user a flair.
             self.parent.reddit.subreddit(self.parent.settings.reddit.subreddit).flair.set(
@@ -156,7 +187,9 @@ class Numbers:
             )
 
             # Add the user to the numbers dictionary.
-            self.parent.numbers[number] = username
+            with self.parent.lock:
+                self.parent.numbers[number] = username
+                self.parent.version += 1
 
             # Approve on the relevant subreddits.
             self.approve_number_subreddits(username, number)
@@ -167,6 +200,13 @@ class Numbers:
             # Print a success message.
             print(f"Succesfully set a user's number. (u/{username} as #{number})")
 
+            # Let the subscribers know about the change.
+            for callback in self.parent.subscribers:
+                try:
+                    callback(username, old_number, number)
+                except Exception as e:
+                    print(f"NUMBERS: Error calling a number change subscriber - {e}")
+
             return number
 
         def approve_number_subreddits(self, username: str, number: int) -> None:
@@ -194,7 +234,16 @@ class Numbers:
         Gets some statistics on the currently assigned numbers.
         :return: The calculated statistics.
         """
-        number_list = self.numbers.keys()
+        return self.calculate_statistics(self.snapshot())
+
+    def calculate_statistics(self, items: list) -> dict:
+        """
+        Calculates some statistics on a snapshot of the assigned numbers.
+        :param items: The number and username pairs (in order).
+        :return: The calculated statistics.
+        """
+        usernames = dict(items)
+        number_list = [number for number, _ in items]
         stats = {
             "numbers_given": 0,  # Amount of Numbers Given
             "sum_of_numbers": 0,  # The sum of all the numbers.
@@ -248,15 +297,15 @@ class Numbers:
         # Format these stats for the message.
         stats["highest_info"] = "#{number} (u/{username})".format(
             number=stats["highest"],
-            username=self.search.num_to_user(stats["highest"]),
+            username=usernames.get(stats["highest"]),
         )
         stats["lowest_positive_info"] = "#{number} (u/{username})".format(
             number=stats["lowest_positive"],
-            username=self.search.num_to_user(stats["lowest_positive"]),
+            username=usernames.get(stats["lowest_positive"]),
         )
         stats["lowest_info"] = "#{number} (u/{username})".format(
             number=stats["lowest"],
-            username=self.search.num_to_user(stats["lowest"]),
+            username=usernames.get(stats["lowest"]),
         )
 
         return stats
@@ -486,6 +535,32 @@ class NumberChecks:
             return True
         return False
 
+    def local_fact(self, number: int) -> str:
+        """
+        Builds a fact about a number from its properties (used when the numbers API is unavailable).
+        Numbers above LOCAL_FACT_FACTORISE_LIMIT aren't factorised (as that can take a very long time).
+        :param number: The number to describe.
+        :return: The fact.
+        """
+        properties = [f"an {self.parity(number).lower()} number"]
+        if self.is_prime_number(number):
+            properties.append("a prime number")
+        if abs(number) <= LOCAL_FACT_FACTORISE_LIMIT:
+            if self.is_semi_prime_number(number):
+                properties.append("a semiprime (the product of two primes)")
+            if self.is_sphenic_number(number):
+                properties.append("a sphenic number (the product of three different primes)")
+            if number >= 0 and self.is_square_number(number):
+                properties.append("a square number")
+        if self.is_palindrome_number(number):
+            properties.append("a palindrome")
+        if self.is_bakery_club(number):
+            properties.append("in the first 5000 decimal places of pi")
+
+        if len(properties) == 1:
+            return f"{number} is {properties[0]}."
+        return f"{number} is {', '.join(properties[:-1])} and {properties[-1]}."
+
     def parity(self, number: int) -> str:
         """
         Gets the parity of a number (odd or even).
@@ -0,0 +1,151 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import sqlite3
+
+from math import ceil
+from time import time
+
+from utils.helpers import get_data_path
+
+
+class PendingVerifications:
+    """
+    Stores the users who are pending verification.
+    Entries are saved to SQLite (so they survive restarts) and are expired using a timer wheel.
+    """
+    def __init__(self, ttl: int = 1800, tick_length: int = 60) -> None:
+        self.ttl = ttl
+        self.tick_length = tick_length
+
+        # Discord ID to the entry and lowercase Reddit username to Discord ID.
+        self.by_discord = {}
+        self.by_username = {}
+
+        # The timer wheel. Each slot holds the Discord IDs of the entries that expire during that tick.
+        self.wheel = [set() for _ in range(ceil(ttl / tick_length) + 2)]
+        self.position = 0
+        self.last_tick = time()
+
+        self.connection = sqlite3.connect(get_data_path("pending_verification.db"))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pending (discord_id INTEGER PRIMARY KEY, username TEXT NOT NULL, code INTEGER NOT NULL, expires REAL NOT NULL)"
+        )
+
+        self.load()
+
+    def load(self) -> None:
+        """
+        Loads the (unexpired) pending verifications from the database.
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM pending WHERE expires <= ?", (time(),))
+            for discord_id, username, code, expires in self.connection.execute("SELECT * FROM pending"):
+                self._add_entry(discord_id, {"username": username, "code": code, "expires": expires})
+        print(f"Loaded {len(self.by_discord)} pending verifications.")
+
+    def _add_entry(self, discord_id: int, entry: dict) -> None:
+        """
+        Adds an entry to the in-memory lookups and the timer wheel.
+        """
+        self.by_discord[discord_id] = entry
+        self.by_username[entry["username"].lower()] = discord_id
+
+        ticks = max(1, ceil((entry["expires"] - self.last_tick) / self.tick_length))
+        self.wheel[(self.position + ticks) % len(self.wheel)].add(discord_id)
+
+    def add(self, discord_id: int, username: str, code: int) -> dict:
+        """
+        Adds a user as pending verification (replacing any existing entry).
+        :param discord_id: The user's Discord ID.
+        :param username: The Reddit username they are verifying as.
+        :param code: The verification code that was sent to them.
+        :return: The entry added.
+        """
+        self.remove(discord_id)
+
+        entry = {"username": username, "code": code, "expires": time() + self.ttl}
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO pending VALUES (?, ?, ?, ?)",
+                (discord_id, username, code, entry["expires"]),
+            )
+        self._add_entry(discord_id, entry)
+        return entry
+
+    def get(self, discord_id: int) -> dict:
+        """
+        Gets the pending verification of a Discord user.
+        :return: The entry (or None if they aren't pending verification).
+        """
+        return self.by_discord.get(discord_id)
+
+    def get_by_username(self, username: str) -> tuple:
+        """
+        Gets the pending verification for a Reddit user.
+        :return: A tuple of the Discord ID and the entry (or None if they aren't pending verification).
+        """
+        discord_id = self.by_username.get(username.lower())
+        if discord_id is None:
+            return None
+        return discord_id, self.by_discord[discord_id]
+
+    def remove(self, discord_id: int) -> None:
+        """
+        Removes a user's pending verification (if they have one).
+        Their ID is left in the timer wheel and is ignored once its slot is reached.
+        """
+        entry = self.by_discord.pop(discord_id, None)
+        if entry is None:
+            return
+
+        if self.by_username.get(entry["username"].lower()) == discord_id:
+            del self.by_username[entry["username"].lower()]
+
+        with self.connection:
+            self.connection.execute("DELETE FROM pending WHERE discord_id = ?", (discord_id,))
+
+    def tick(self) -> list:
+        """
+        Advances the timer wheel for the time that has passed and expires any entries that are due.
+        :return: The Discord IDs that were expired.
+        """
+        now = time()
+        expired = []
+        while self.last_tick + self.tick_length <= now:
+            self.last_tick += self.tick_length
+            self.position = (self.position + 1) % len(self.wheel)
+
+            slot = self.wheel[self.position]
+            self.wheel[self.position] = set()
+            for discord_id in slot:
+                entry = self.by_discord.get(discord_id)
+                if entry is None:
+                    continue
+
+                # The entry may have been replaced with a newer one since it was placed in this slot.
+                if entry["expires"] <= now:
+                    self.remove(discord_id)
+                    expired.append(discord_id)
+                else:
+                    self._add_entry(discord_id, entry)
+
+        return expired
+
+    def __contains__(self, discord_id: int) -> bool:
+        return discord_id in self.by_discord
+
+    def __len__(self) -> int:
+        return len(self.by_discord)
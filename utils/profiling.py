@@ -0,0 +1,130 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import tracemalloc
+
+from sys import _current_frames
+from os import path
+from time import perf_counter, sleep
+from collections import Counter
+
+
+def frame_name(frame) -> str:
+    """
+    Gets a short name for a frame (its file, line and function).
+    """
+    code = frame.f_code
+    return f"{path.basename(code.co_filename)}:{frame.f_lineno} ({code.co_name})"
+
+
+def function_name(frame) -> str:
+    """
+    Gets a short name for the function of a frame (its file, first line and name).
+    """
+    code = frame.f_code
+    return f"{path.basename(code.co_filename)}:{code.co_firstlineno} ({code.co_name})"
+
+
+def sample_threads(threads: dict, seconds: float, interval: float = 0.005) -> dict:
+    """
+    Samples the stacks of some threads for a while (this blocks, so it should be run in its own thread).
+    :param threads: The IDs of the threads to sample to their names.
+    :param seconds: How long to sample for.
+    :param interval: The time between samples.
+    :return: The samples of each thread (by name) with their sample count, self counts and cumulative counts.
+    """
+    results = {name: {"samples": 0, "self": Counter(), "cumulative": Counter()} for name in threads.values()}
+
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        frames = _current_frames()
+        for thread_id, name in threads.items():
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+
+            result = results[name]
+            result["samples"] += 1
+            result["self"][frame_name(frame)] += 1
+
+            # Count each function once per sample (even if it is recursive).
+            seen = set()
+            while frame is not None:
+                seen.add(function_name(frame))
+                frame = frame.f_back
+            result["cumulative"].update(seen)
+
+        del frames
+        sleep(interval)
+
+    return results
+
+
+def format_profile(results: dict, seconds: float, top: int = 25) -> str:
+    """
+    Formats the results of sample_threads into a report.
+    :param results: The results of sample_threads.
+    :param seconds: How long the threads were sampled for.
+    :param top: The amount of entries to show for each thread.
+    :return: The report.
+    """
+    lines = [f"Sampling profile over {seconds:.1f}s", ""]
+    for name, result in results.items():
+        samples = result["samples"]
+        lines.append(f"=== {name} ({samples} samples) ===")
+        if samples == 0:
+            lines.extend(["No samples (the thread isn't running).", ""])
+            continue
+
+        for title, counter in (("Self (where the thread was)", result["self"]), ("Cumulative (including callees)", result["cumulative"])):
+            lines.append(f"-- {title} --")
+            for location, count in counter.most_common(top):
+                lines.append(f"{count / samples:7.1%} {count:6d}  {location}")
+            lines.append("")
+
+    return "\n".join(lines)
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    """
+    Takes a tracemalloc snapshot (without the allocations made by tracemalloc itself).
+    """
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+
+
+def format_snapshot_diff(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, seconds: float, top: int = 30) -> str:
+    """
+    Compares two tracemalloc snapshots.
+    :return: A report of the allocations that grew the most.
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [
+        f"Memory growth over {seconds:.0f}s",
+        f"Traced: {current / 1024 / 1024:.2f} MiB (peak {peak / 1024 / 1024:.2f} MiB)",
+        "",
+        "-- Top growth by line --",
+    ]
+    for stat in after.compare_to(before, "lineno")[:top]:
+        lines.append(str(stat))
+
+    lines.extend(["", "-- Top growth by call stack --"])
+    for stat in after.compare_to(before, "traceback")[:5]:
+        lines.append(f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks)")
+        lines.extend(f"    {line}" for line in stat.traceback.format()[-8:])
+
+    return "\n".join(lines)
@@ -0,0 +1,99 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from json import loads, dumps
+from hashlib import sha1
+
+from threading import Lock
+from asyncio import sleep, get_event_loop
+
+from utils.helpers import get_data_path
+
+
+class Publisher:
+    """
+    Publishes content to Reddit (such as wiki pages and widgets).
+    Writes of content that hasn't changed since it was last published are skipped,
+    and writes to the same target made within a short window are merged into one.
+    """
+    def __init__(self, window: float = 10.0) -> None:
+        self.window = window
+        self.path = get_data_path("published_hashes.json")
+
+        # The hash of the content last published to each target.
+        self.hashes = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as hashes_file:
+                self.hashes = loads(hashes_file.read())
+        except FileNotFoundError:
+            pass
+
+        # The latest content (and write function) waiting to be published for each target.
+        self.pending = {}
+        self.lock = Lock()
+
+    def is_unchanged(self, target: str, content: str) -> bool:
+        """
+        Checks if some content is the same as what was last published to a target.
+        :param target: The name of the target (e.g 'wiki:config/sidebar').
+        :param content: The content to check.
+        :return: Whether it is the same.
+        """
+        return self.hashes.get(target) == sha1(content.encode("utf-8")).hexdigest()
+
+    def publish_now(self, target: str, content: str, write) -> bool:
+        """
+        Publishes content to a target straight away (unless it hasn't changed).
+        :param target: The name of the target.
+        :param content: The content to publish.
+        :param write: The function that writes the content to Reddit (called with the content).
+        :return: Whether the content was written.
+        """
+        with self.lock:
+            if self.is_unchanged(target, content):
+                return False
+
+            write(content)
+
+            self.hashes[target] = sha1(content.encode("utf-8")).hexdigest()
+            with open(self.path, "w", encoding="utf-8") as hashes_file:
+                hashes_file.write(dumps(self.hashes))
+        return True
+
+    def publish(self, target: str, content: str, write) -> None:
+        """
+        Queues content to be published to a target at the end of the publish window.
+        Only the latest content queued for a target within the window is written. This must be called from the event loop.
+        :param target: The name of the target.
+        :param content: The content to publish.
+        :param write: The function that writes the content to Reddit (called with the content).
+        """
+        already_pending = target in self.pending
+        self.pending[target] = (content, write)
+        if not already_pending:
+            get_event_loop().create_task(self.publish_pending(target))
+
+    async def publish_pending(self, target: str) -> None:
+        """
+        Waits for the publish window to pass and then publishes the latest content for a target (in an executor).
+        :param target: The name of the target.
+        """
+        await sleep(self.window)
+        content, write = self.pending.pop(target)
+        try:
+            if await get_event_loop().run_in_executor(None, self.publish_now, target, content, write):
+                print(f"PUBLISHER: Published '{target}'.")
+        except Exception as e:
+            print(f"PUBLISHER: Failed to publish '{target}' - {e}")
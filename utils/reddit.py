@@ -14,6 +14,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import praw
+from praw.exceptions import RedditAPIException
+from prawcore.exceptions import ServerError, RequestException
+
+from time import time, sleep
+from collections import deque
+from threading import Thread, Condition
 
 
 class TNGReddit(praw.Reddit):
@@ -61,6 +67,107 @@ class TNGReddit(praw.Reddit):
         return True
 
 
+class MessageQueue:
+    """
+    Sends Reddit private messages from a background thread.
+    Sends are paced against the rate limit, transient failures are retried and repeat requests (with the same key) are merged.
+    """
+    def __init__(self, reddit, interval: float = 3.0, retries: int = 3) -> None:
+        self.reddit = reddit
+        self.interval = interval
+        self.retries = retries
+
+        # The keys of the queued messages (in order) and the messages themselves.
+        self.queue = deque()
+        self.messages = {}
+        self.condition = Condition()
+
+        self.thread = Thread(target=self.run, name="pm-queue", daemon=True)
+        self.thread.start()
+
+    def send(self, key, username: str, subject: str, text: str, on_failure=None) -> int:
+        """
+        Queues a private message to be sent.
+        If a message with the same key is already queued then it is replaced (keeping its place in the queue).
+        :param key: The key used to merge repeat requests (such as the requesting Discord user).
+        :param username: The user to message.
+        :param subject: The subject of the message.
+        :param text: The text of the message.
+        :param on_failure: Optional. Called (from the queue thread) with the key if the message couldn't be sent.
+        :return: The position of the message in the queue.
+        """
+        with self.condition:
+            if key not in self.messages:
+                self.queue.append(key)
+            self.messages[key] = (username, subject, text, on_failure)
+            self.condition.notify()
+            return self.queue.index(key) + 1
+
+    def eta(self, position: int) -> int:
+        """
+        Estimates how long until a message at a certain position is sent.
+        :param position: The position in the queue.
+        :return: The estimated time (in seconds).
+        """
+        return int(position * self.interval + self.rate_limit_wait())
+
+    def rate_limit_wait(self) -> float:
+        """
+        Works out how long to wait for the rate limit to reset (if the remaining budget is low).
+        :return: The time to wait (in seconds).
+        """
+        limits = self.reddit.auth.limits
+        if limits.get("remaining") is not None and limits["remaining"] < 5:
+            return max(0, limits["reset_timestamp"] - time())
+        return 0
+
+    def run(self) -> None:
+        """
+        Sends the queued messages.
+        """
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                key = self.queue.popleft()
+                username, subject, text, on_failure = self.messages.pop(key)
+
+            if not self.deliver(username, subject, text) and on_failure is not None:
+                try:
+                    on_failure(key)
+                except Exception as e:
+                    print(f"MESSAGE QUEUE: Error calling the failure callback - {e}")
+
+            # Pace the sends (waiting longer if the rate limit is nearly used up).
+            sleep(self.interval + self.rate_limit_wait())
+
+    def deliver(self, username: str, subject: str, text: str) -> bool:
+        """
+        Sends a private message, retrying transient failures.
+        :return: Whether the message was sent.
+        """
+        for attempt in range(self.retries):
+            try:
+                self.reddit.redditor(username).message(subject, text)
+                return True
+            except (ServerError, RequestException) as e:
+                print(f"MESSAGE QUEUE: Failed to message u/{username} (attempt {attempt + 1}) - {e}")
+            except RedditAPIException as e:
+                # Only retry if Reddit is rate limiting messages.
+                if not any(item.error_type == "RATELIMIT" for item in e.items):
+                    print(f"MESSAGE QUEUE: Reddit refused the message to u/{username} - {e}")
+                    return False
+                print(f"MESSAGE QUEUE: Rate limited messaging u/{username} (attempt {attempt + 1}).")
+            except Exception as e:
+                print(f"MESSAGE QUEUE: Failed to message u/{username} - {e}")
+                return False
+            sleep(5 * 2 ** attempt)
+        return False
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+
 reddit_instance = None
 def initiate_reddit(auth_info, main_sub_name):
     global reddit_instance
@@ -0,0 +1,248 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from pytz import utc
+from json import loads, dumps
+from random import uniform
+from time import perf_counter
+from asyncio import sleep, get_event_loop
+from datetime import datetime, timedelta
+
+from utils.sentry import get_sentry
+from utils.helpers import get_time, get_data_path
+
+# Every job's schedule is aligned to this time (midnight UTC).
+SCHEDULE_EPOCH = datetime(2020, 1, 1, tzinfo=utc)
+
+
+class Job:
+    """
+    A job that runs at fixed times, every interval (shifted by an offset) from midnight UTC.
+    For example an interval of one day with an offset of 23 hours 55 minutes runs at 23:55 UTC every day.
+    """
+    def __init__(
+        self, name: str, func, interval: timedelta, offset: timedelta, catch_up: str, jitter: float, on_catch_up=None, persist: bool = True,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.offset = offset
+        self.catch_up = catch_up
+        self.jitter = jitter
+        self.on_catch_up = on_catch_up
+        self.persist = persist
+
+        self.last_run = None
+        self.next_run = None
+
+        # The scheduled time of the last run that failed (and the error it failed with).
+        self.last_failure = None
+        self.last_error = None
+
+        # Timing metrics.
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+
+    def slot_before(self, time: datetime) -> datetime:
+        """
+        Gets the latest time the job was scheduled for (at or before a certain time).
+        """
+        return SCHEDULE_EPOCH + self.offset + self.interval * ((time - SCHEDULE_EPOCH - self.offset) // self.interval)
+
+    def slot_after(self, time: datetime) -> datetime:
+        """
+        Gets the next time the job is scheduled for (after a certain time).
+        """
+        return self.slot_before(time) + self.interval
+
+    def missed_runs(self, now: datetime) -> list:
+        """
+        Gets the scheduled times that were missed since the job last ran.
+        """
+        if self.last_run is None:
+            return []
+
+        missed = []
+        due = self.slot_after(self.last_run)
+        while due <= now:
+            missed.append(due)
+            due += self.interval
+        return missed
+
+    @property
+    def average_duration(self) -> float:
+        return self.total_duration / self.runs if self.runs else 0.0
+
+
+class Scheduler:
+    """
+    Runs jobs at scheduled times. The last run time of each job is saved, so runs missed while
+    the bot was down can be caught up on (depending on the job's catch up policy).
+    Catch up policies:
+    * 'skip' - Missed runs are ignored.
+    * 'latest' - Only the most recent missed run is done.
+    * 'all' - Every missed run is done (in order). If the job has an on_catch_up function,
+      it is called once with all of the missed times instead.
+    A run is only recorded once it has succeeded, so a failed run is caught up on when the bot next starts.
+    However if a later run succeeds first, the failed run is passed over (which is logged and sent to Sentry).
+    Jobs can also record their own runs (with record_run), such as after each day that a catch up does.
+    """
+    def __init__(self) -> None:
+        self.path = get_data_path("scheduler.json")
+
+        self.last_runs = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as scheduler_file:
+                self.last_runs = {name: datetime.fromisoformat(time) for name, time in loads(scheduler_file.read()).items()}
+        except FileNotFoundError:
+            pass
+
+        self.jobs = {}
+        self.started = False
+
+    def register(
+        self,
+        name: str,
+        func,
+        interval: timedelta,
+        offset: timedelta = timedelta(0),
+        catch_up: str = "skip",
+        jitter: float = 0,
+        on_catch_up=None,
+        persist: bool = True,
+    ) -> Job:
+        """
+        Registers a job with the scheduler.
+        :param name: The (unique) name of the job.
+        :param func: The coroutine function to run. It is called with the time the run was scheduled for.
+            It can record its own run (with record_run).
+        :param interval: How often the job runs.
+        :param offset: Optional. How far past midnight UTC the schedule is shifted.
+        :param catch_up: Optional. The catch up policy for runs missed while the bot was down.
+        :param jitter: Optional. The maximum random delay (in seconds) added to each run.
+        :param on_catch_up: Optional. A coroutine function called with the list of missed times (for the 'all' policy).
+            If it fails, only the runs that it recorded itself are kept.
+        :param persist: Optional. Whether to save the job's last run time (which frequent jobs that skip missed runs don't need).
+        :return: The registered job.
+        """
+        job = Job(name, func, interval, offset, catch_up, jitter, on_catch_up, persist)
+        job.last_run = self.last_runs.get(name) if persist else None
+        self.jobs[name] = job
+
+        if self.started:
+            get_event_loop().create_task(self.run_job(job))
+        return job
+
+    def start(self) -> None:
+        """
+        Starts running the registered jobs.
+        """
+        if self.started:
+            return
+        self.started = True
+
+        for job in self.jobs.values():
+            get_event_loop().create_task(self.run_job(job))
+
+    def save(self) -> None:
+        """
+        Saves the last run times of the jobs.
+        """
+        with open(self.path, "w", encoding="utf-8") as scheduler_file:
+            scheduler_file.write(dumps({name: time.isoformat() for name, time in self.last_runs.items()}))
+
+    async def run_job(self, job: Job) -> None:
+        """
+        Catches up on a job's missed runs and then runs it at each scheduled time.
+        """
+        now = get_time()
+
+        if job.last_run is None:
+            # The job has never run, so start tracking it from its latest scheduled time.
+            self.record_run(job, job.slot_before(now))
+        else:
+            missed = job.missed_runs(now)
+            if missed and job.catch_up != "skip":
+                print(f"SCHEDULER: Catching up on {len(missed)} missed run(s) of '{job.name}'.")
+                if job.catch_up == "all" and job.on_catch_up is not None:
+                    await self.execute(job, missed[-1], job.on_catch_up(missed))
+                else:
+                    for due in (missed if job.catch_up == "all" else missed[-1:]):
+                        await self.execute(job, due)
+            elif missed:
+                self.record_run(job, missed[-1])
+
+        while True:
+            # Work out the next run from the schedule itself (so that runs don't drift).
+            job.next_run = job.slot_after(max(get_time(), job.last_run))
+            await sleep((job.next_run - get_time()).total_seconds() + uniform(0, job.jitter))
+
+            # Make sure that the sleep didn't wake up early.
+            while get_time() < job.next_run:
+                await sleep((job.next_run - get_time()).total_seconds())
+
+            await self.execute(job, job.next_run)
+
+    async def execute(self, job: Job, due: datetime, run=None) -> None:
+        """
+        Runs a job once, recording its timing. The run is only recorded if it succeeds.
+        :param job: The job to run.
+        :param due: The time the run was scheduled for.
+        :param run: Optional. The coroutine to run instead of the job's function (used when catching up).
+        """
+        previous_run = job.last_run
+        start = perf_counter()
+        try:
+            await (run if run is not None else job.func(due))
+        except Exception as e:
+            job.failures += 1
+            job.last_failure = due
+            job.last_error = str(e)
+            sentry = get_sentry()
+            if sentry:
+                sentry.capture_exception(e)
+            print(f"SCHEDULER: Error running '{job.name}' for {due:%d/%m/%Y %H:%M} UTC (it hasn't been recorded) - {e}")
+        else:
+            # Record the run (unless the job already recorded it itself).
+            if job.last_run is None or job.last_run < due:
+                self.record_run(job, due)
+
+            # Report a failed run that won't be caught up on now that a later run has been recorded.
+            if job.catch_up != "skip" and job.last_failure is not None and previous_run is not None and previous_run < job.last_failure < due:
+                message = f"SCHEDULER: The failed run of '{job.name}' for {job.last_failure:%d/%m/%Y %H:%M} UTC has been passed over."
+                sentry = get_sentry()
+                if sentry:
+                    sentry.capture_message(message)
+                print(message)
+        finally:
+            duration = perf_counter() - start
+            job.runs += 1
+            job.last_duration = duration
+            job.total_duration += duration
+            job.max_duration = max(job.max_duration, duration)
+
+    def record_run(self, job: Job, due: datetime) -> None:
+        """
+        Records the scheduled time a job last ran for.
+        :param job: The job that ran.
+        :param due: The time the run was scheduled for.
+        """
+        job.last_run = due
+        if job.persist:
+            self.last_runs[job.name] = due
+            self.save()
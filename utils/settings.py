@@ -19,6 +19,114 @@ from dotenv import load_dotenv
 
 from sys import exit
 from os import getenv
+from types import MappingProxyType
+from dataclasses import dataclass
+
+from utils.errors import InvalidSettingsError
+
+
+@dataclass(frozen=True)
+class CompiledSettings:
+    """
+    An immutable snapshot of the settings used on hot paths (such as the checks), with the IDs resolved to ints.
+    This is compiled (and validated) once whenever the settings are loaded.
+    """
+    __slots__ = (
+        "main_guild", "admins", "developers",
+        "verified_role", "numberless_role", "moderator_role",
+        "nation_roles", "parity_roles", "country_roles", "organization_roles", "ping_roles", "number_roles",
+        "log_channels", "selection_log_channels", "feed_channels",
+    )
+
+    main_guild: int
+    admins: frozenset
+    developers: frozenset
+
+    verified_role: int
+    numberless_role: int
+    moderator_role: int
+
+    # Role names to role IDs.
+    nation_roles: MappingProxyType
+    parity_roles: MappingProxyType
+    country_roles: MappingProxyType
+    organization_roles: MappingProxyType
+    ping_roles: MappingProxyType
+
+    # The IDs of the roles that depend on a user's number (nations, parity and numberless).
+    number_roles: frozenset
+
+    # Channel names to channel IDs.
+    log_channels: MappingProxyType
+    selection_log_channels: MappingProxyType
+    feed_channels: MappingProxyType
+
+
+def compile_settings(settings: dict) -> CompiledSettings:
+    """
+    Compiles the settings into a CompiledSettings snapshot.
+    :param settings: The (merged) settings.
+    :return: The compiled settings.
+    :raises InvalidSettingsError: If a required value is missing or isn't valid.
+    """
+    def lookup(*path):
+        value = settings
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                raise InvalidSettingsError(f"The setting '{'.'.join(path)}' is missing.")
+            value = value[key]
+        return value
+
+    def to_id(value, *path) -> int:
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise InvalidSettingsError(f"The setting '{'.'.join(path)}' must be an ID (got {value!r}).")
+        return value
+
+    def id_map(*path) -> MappingProxyType:
+        value = lookup(*path)
+        if not isinstance(value, dict):
+            raise InvalidSettingsError(f"The setting '{'.'.join(path)}' must be a mapping of names to IDs.")
+        return MappingProxyType({str(name): to_id(item, *path, str(name)) for name, item in value.items()})
+
+    def id_set(*path) -> frozenset:
+        value = lookup(*path)
+        if not isinstance(value, list):
+            raise InvalidSettingsError(f"The setting '{'.'.join(path)}' must be a list of IDs.")
+        return frozenset(to_id(item, *path) for item in value)
+
+    other_roles = id_map("discord", "role_ids", "other")
+    for name in ("Verified", "Numberless", "Moderator"):
+        if name not in other_roles:
+            raise InvalidSettingsError(f"The setting 'discord.role_ids.other.{name}' is missing.")
+
+    nation_roles = id_map("discord", "role_ids", "nations")
+    parity_roles = id_map("discord", "role_ids", "odd_and_even")
+
+    log_channels = dict(lookup("discord", "ids", "log_channels"))
+    log_channels.pop("selection_logs", None)
+
+    return CompiledSettings(
+        main_guild=to_id(lookup("discord", "ids", "main_guild"), "discord", "ids", "main_guild"),
+        admins=id_set("discord", "admins"),
+        developers=id_set("discord", "developers"),
+
+        verified_role=other_roles["Verified"],
+        numberless_role=other_roles["Numberless"],
+        moderator_role=other_roles["Moderator"],
+
+        nation_roles=nation_roles,
+        parity_roles=parity_roles,
+        country_roles=id_map("discord", "role_ids", "countries"),
+        organization_roles=id_map("discord", "role_ids", "organizations"),
+        ping_roles=id_map("discord", "role_ids", "ping_notifications"),
+        number_roles=frozenset(nation_roles.values()) | frozenset(parity_roles.values()) | {other_roles["Numberless"]},
+
+        log_channels=MappingProxyType({
+            name: to_id(channel_id, "discord", "ids", "log_channels", name) for name, channel_id in log_channels.items()
+        }),
+        selection_log_channels=id_map("discord", "ids", "log_channels", "selection_logs"),
+        feed_channels=id_map("discord", "ids", "feed_channels"),
+    )
 
 
 class Settings:
@@ -37,18 +145,83 @@ class Settings:
             print(f"{e} - Error loading/reading the settings file.")
             exit()
 
+        # The file settings (which the wiki settings are merged on top of).
+        self.file_settings = self.settings
+
+        # The revision of the wiki settings that were last loaded.
+        self.revision_id = None
+
+        # The compiled snapshot of the settings (compiled once the wiki settings have been loaded).
+        self.compiled = None
+
+        # Callbacks that are called when certain settings change (a list of key paths and the callback).
+        self.subscribers = []
+
         # Initiate the subclasses.
-        self.reddit = self.reddit(self)
-        self.discord = self.discord(self)
-        self.templates = self.templates(self)
+        self.build_subclasses()
+
+    def build_subclasses(self) -> None:
+        """
+        (Re)builds the subclasses (as some of them keep a reference to their part of the settings).
+        """
+        self.reddit = Settings.reddit(self)
+        self.discord = Settings.discord(self)
+        self.templates = Settings.templates(self)
 
-    def load_wiki_settings(self, reddit_instance) -> None:
+    def subscribe(self, keys: list, callback) -> None:
         """
-        Loads settings from the subreddit wiki page.
+        Subscribes a callback to changes of certain settings.
+        :param keys: The key paths (tuples) of the settings that the callback depends on.
+        :param callback: The function to call with the set of changed key paths.
         """
-        reddit_wiki_settings = safe_load(reddit_instance.main_subreddit.wiki["botsettings"].content_md)
-        self.settings = merge(self.settings, reddit_wiki_settings)
-        print("Loaded the Reddit wiki settings.")
+        self.subscribers.append(([tuple(key) for key in keys], callback))
+
+    def load_wiki_settings(self, reddit_instance, force: bool = False, notify: bool = True) -> set:
+        """
+        Loads settings from the subreddit wiki page (if it has been revised since it was last loaded).
+        :param force: Whether to load the settings even if the revision hasn't changed.
+        :param notify: Whether to notify the subscribers of the changes (otherwise use notify after).
+        :return: The key paths of the settings that changed.
+        :raises InvalidSettingsError: If the merged settings aren't valid (the current settings are kept).
+        """
+        wiki_page = reddit_instance.main_subreddit.wiki["botsettings"]
+
+        # Check the latest revision first (which is much smaller than the page itself).
+        if not force and self.revision_id is not None:
+            latest_revision = next(wiki_page.revisions(limit=1), None)
+            if latest_revision is not None and latest_revision["id"] == self.revision_id:
+                print("The Reddit wiki settings haven't changed.")
+                return set()
+
+        content = wiki_page.content_md
+
+        # Compile the new settings before using them so that invalid settings are never used.
+        new_settings = merge(self.file_settings, safe_load(content))
+        self.compiled = compile_settings(new_settings)
+
+        old_settings = self.settings
+        self.settings = new_settings
+        self.revision_id = wiki_page.revision_id
+        self.build_subclasses()
+
+        changed = changed_keys(old_settings, self.settings)
+        print(f"Loaded the Reddit wiki settings ({len(changed)} changed).")
+
+        if notify:
+            self.notify(changed)
+        return changed
+
+    def notify(self, changed: set) -> None:
+        """
+        Calls the subscribers whose settings have changed.
+        :param changed: The key paths of the settings that changed.
+        """
+        for keys, callback in self.subscribers:
+            if any(key[:len(path)] == path or path[:len(key)] == key for key in keys for path in changed):
+                try:
+                    callback(changed)
+                except Exception as e:
+                    print(f"SETTINGS: Error calling a settings subscriber - {e}")
 
     class reddit:
         def __init__(self, parent) -> None:
@@ -199,10 +372,36 @@ class Settings:
     def sentry_link(self) -> str:
         return getenv("SENTRY_LINK")
 
+    @property
+    def metrics_port(self) -> int:
+        port = getenv("METRICS_PORT")
+        return int(port) if port else None
+
+    @property
+    def metrics_host(self) -> str:
+        return getenv("METRICS_HOST") or "127.0.0.1"
+
     def __repr__(self) -> dict:
         return self.settings
 
 
+def changed_keys(old, new, path: tuple = ()) -> set:
+    """
+    Compares two versions of the settings.
+    :return: The key paths (tuples) of the settings that are different.
+    """
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return set() if old == new else {path}
+
+    changed = set()
+    for key in old.keys() | new.keys():
+        if key not in old or key not in new:
+            changed.add(path + (key,))
+        else:
+            changed |= changed_keys(old[key], new[key], path + (key,))
+    return changed
+
+
 def init_settings():
     global settings_instance
     settings_instance = Settings()
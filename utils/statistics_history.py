@@ -0,0 +1,91 @@
+"""
+Copyright 2020 OneUpPotato
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import sqlite3
+
+from utils.helpers import get_data_path
+
+
+class StatisticsHistory:
+    """
+    A time series of the daily number statistics (one row per Num Day), saved to SQLite.
+    """
+    COLUMNS = ("num_day", "date", "count", "sum", "mean", "median", "odds", "evens")
+
+    def __init__(self) -> None:
+        self.connection = sqlite3.connect(get_data_path("statistics_history.db"))
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS daily ("
+                "num_day INTEGER PRIMARY KEY, date TEXT NOT NULL, count INTEGER NOT NULL, sum INTEGER NOT NULL, "
+                "mean REAL NOT NULL, median REAL NOT NULL, odds INTEGER NOT NULL, evens INTEGER NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS nations ("
+                "num_day INTEGER NOT NULL, nation TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (num_day, nation))"
+            )
+
+    def record(self, num_day: int, date: str, statistics: dict, nations: dict) -> None:
+        """
+        Records the statistics of a Num Day (replacing any that were already recorded for it).
+        :param num_day: The Num Day.
+        :param date: The date of the Num Day.
+        :param statistics: The number statistics (count, sum, mean, median, odds and evens).
+        :param nations: The amount of numbers in each nation.
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO daily VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (num_day, date, *[statistics[column] for column in self.COLUMNS[2:]]),
+            )
+            self.connection.execute("DELETE FROM nations WHERE num_day = ?", (num_day,))
+            self.connection.executemany(
+                "INSERT INTO nations VALUES (?, ?, ?)",
+                [(num_day, nation, count) for nation, count in nations.items()],
+            )
+
+    def get(self, num_day: int) -> dict:
+        """
+        Gets the statistics recorded for a Num Day.
+        :return: The statistics (or None if none were recorded).
+        """
+        row = self.connection.execute("SELECT * FROM daily WHERE num_day = ?", (num_day,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(self.COLUMNS, row))
+
+    def latest(self, days: int, num_day: int) -> list:
+        """
+        Gets the statistics recorded over the last few Num Days (there is one Num Day per calendar day).
+        Days that have no recorded statistics are left out.
+        :param days: The amount of days to get.
+        :param num_day: The last Num Day to get.
+        :return: The statistics (oldest first).
+        """
+        rows = self.connection.execute(
+            "SELECT * FROM daily WHERE num_day > ? AND num_day <= ? ORDER BY num_day",
+            (num_day - days, num_day),
+        ).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def nations(self, num_day: int) -> dict:
+        """
+        Gets the nation distribution recorded for a Num Day.
+        :return: The amount of numbers in each nation.
+        """
+        return dict(self.connection.execute("SELECT nation, count FROM nations WHERE num_day = ?", (num_day,)))
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM daily").fetchone()[0]
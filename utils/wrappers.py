@@ -19,6 +19,10 @@ from time import sleep
 from functools import wraps
 
 from utils.sentry import get_sentry
+from utils.metrics import metrics
+
+# The longest (in seconds) that a stream waits between polls that had no new items.
+MAX_STREAM_BACKOFF = 16
 
 
 def stream_wrapper(func):
@@ -38,3 +42,24 @@ def stream_wrapper(func):
                     sentry.capture_exception(e)
                 print(f"PRAW STREAM: Error raised {e}.")
     return wrapper
+
+
+def paced_stream(stream, name: str):
+    """
+    Yields the items of a PRAW stream (made with pause_after=-1), recording its metrics.
+    PRAW doesn't back off when it pauses, so this sleeps after each poll that had no new items
+    (doubling the wait up to MAX_STREAM_BACKOFF seconds until there is a new item).
+    :param stream: The PRAW stream.
+    :param name: The name of the stream (in the metrics).
+    """
+    backoff = 1
+    for item in stream:
+        if item is None:
+            metrics.stream_heartbeat(name)
+            sleep(backoff)
+            backoff = min(backoff * 2, MAX_STREAM_BACKOFF)
+            continue
+
+        backoff = 1
+        metrics.stream_item(name, item.created_utc)
+        yield item